@@ -17,81 +17,354 @@ def mean_boolean_error(predictions, targets):
 #______________________________________________________________________________
 
 class NaiveBayesLearner(Learner):
+
+    def __init__(self, gaussian=False):
+        """With gaussian, each numeric input is modelled by a normal
+        distribution for each target value, kept as a running mean and
+        variance, instead of counting every distinct number as a value."""
+        self.gaussian = gaussian
     
     def train(self, dataset):
         """Just count the target/attr/val occurences.
-        Count how many times each value of each attribute occurs.
-        Store count in N[targetvalue][attr][val]. Let N[attr][None] be the
-        sum over all vals."""
-        N = {}
+        Count how many times each value of each discrete input occurs with
+        each target value, in an array indexed by [target code, input number,
+        value code], the codes being positions in self.values (which starts
+        out as a copy of dataset.values).  It has one more value slot than
+        the widest input, which stays 0: the count for a value that was never
+        seen.  Continuous inputs get a mean and a sum of squared deviations
+        per target value instead.  Then compute the log-probabilities."""
         self.dataset = dataset
-        ## Initialize to 0
-        for gv in self.dataset.values[self.dataset.target]:
-            N[gv] = {}
-            for attr in self.dataset.attrs:
-                N[gv][attr] = {}
-                for val in self.dataset.values[attr]:
-                    N[gv][attr][val] = 0
-                    N[gv][attr][None] = 0
-        ## Go thru examples
-        for example in self.dataset.examples:
-            Ngv = N[example[self.dataset.target]]
-            for attr in self.dataset.attrs:
-                Ngv[attr][example[attr]] += 1
-                Ngv[attr][None] += 1
-        self._N = N
+        self.target, self.inputs = dataset.target, dataset.inputs
+        self.continuous = [a for a in self.inputs
+                           if self.gaussian and dataset.is_numeric(a)]
+        self.discrete = [a for a in self.inputs if a not in self.continuous]
+        self.values = [[] for vals in dataset.values]
+        self.index = [{} for vals in dataset.values]
+        self.counts = np.zeros((0, len(self.discrete), 1), np.int64)
+        self.class_counts = np.zeros(0, np.int64)
+        self.means = np.zeros((0, len(self.continuous)))
+        self.m2 = np.zeros((0, len(self.continuous)))
+        self.partial_fit(dataset)
+
+    def partial_fit(self, examples):
+        """Add examples to the counts of a trained learner: a DataSet, a
+        DataSetView, or a list of rows (such as a chunk from read_csv).
+        Values that haven't been seen before are added to self.values."""
+        if not hasattr(self, 'counts'):
+            raise ValueError('Train on a DataSet first, to set the target and inputs')
+        attrs = self.discrete + [self.target]
+        if hasattr(examples, 'code_matrix'):
+            ## Translate the dataset's codes into ours
+            matrix = examples.code_matrix(attrs)
+            codes = np.empty(matrix.shape, np.int32)
+            for j, a in enumerate(attrs):
+                recode = np.array([self.code(a, v) for v in examples.values[a]],
+                                  np.int32)
+                codes[:, j] = recode[matrix[:, j]]
+            numbers = [examples.column(a) for a in self.continuous]
+        else:
+            examples = list(examples)
+            codes = np.array([[self.code(a, example[a]) for a in attrs]
+                              for example in examples], np.int32)
+            codes = codes.reshape(-1, len(attrs))
+            numbers = [[example[a] for example in examples]
+                       for a in self.continuous]
+        self.grow()
+        classes, codes = codes[:, -1], codes[:, :-1]
+        nclasses, ninputs, width = self.counts.shape
+        ## One bincount over the flattened [class, input, value] index
+        cells = (classes[:, None] * ninputs + np.arange(ninputs)) * width + codes
+        self.counts += np.bincount(cells.ravel(), minlength=self.counts.size
+                                   ).reshape(self.counts.shape)
+        ## The mean and squared deviations of this batch, for each class
+        n = np.bincount(classes, minlength=nclasses)
+        means = np.zeros((nclasses, len(self.continuous)))
+        m2 = np.zeros((nclasses, len(self.continuous)))
+        for k, column in enumerate(numbers):
+            column = np.asarray(column, np.float64)
+            means[:, k] = np.bincount(classes, column, nclasses) / np.maximum(n, 1)
+            m2[:, k] = np.bincount(classes, (column - means[classes, k])**2, nclasses)
+        self.add_class_stats(np.arange(nclasses), n, means, m2)
+        self.compute_log_probs()
+        return self
+
+    def merge(self, other):
+        """Add the counts of other, a NaiveBayesLearner trained on other
+        examples with the same target and inputs, to this one's.  Values
+        are matched up by value, not code, so the learners may have been
+        trained on different DataSets.  Returns self."""
+        if (other.target, other.inputs, other.continuous) != \
+           (self.target, self.inputs, self.continuous):
+            raise ValueError('Can only merge learners with the same target and inputs')
+        recode = dict([(a, [self.code(a, v) for v in other.values[a]])
+                       for a in self.discrete + [self.target]])
+        self.grow()
+        classes = recode[self.target]
+        for j, a in enumerate(self.discrete):
+            self.counts[np.ix_(classes, [j], recode[a])] += \
+                other.counts[:, j:j+1, :len(recode[a])]
+        self.add_class_stats(classes, other.class_counts, other.means, other.m2)
+        self.compute_log_probs()
+        return self
+
+    def add_class_stats(self, classes, n, means, m2):
+        """Add n more examples of each of the target codes classes, whose
+        continuous inputs have the given means and sums of squared deviations
+        from them.  The running means and sums are combined by the pairwise
+        update of Chan et al. (Welford's, when adding a single example)."""
+        n_a = self.class_counts[classes][:, None].astype(np.float64)
+        n_b = np.asarray(n, np.float64)[:, None]
+        delta = means - self.means[classes]
+        total = np.maximum(n_a + n_b, 1)
+        self.means[classes] += delta * n_b / total
+        self.m2[classes] += m2 + delta**2 * n_a * n_b / total
+        self.class_counts[classes] += n
+
+    def code(self, attr, value):
+        "Return the code of value for attr, adding it to self.values if new."
+        index = self.index[attr]
+        if value not in index:
+            index[value] = len(self.values[attr])
+            self.values[attr].append(value)
+        return index[value]
+
+    def grow(self):
+        """Make room in the arrays for any target values and input values
+        added to self.values, keeping one spare slot for unseen values."""
+        nclasses = len(self.values[self.target])
+        width = max([len(self.values[a]) for a in self.discrete] + [0]) + 1
+        c, n, w = self.counts.shape
+        if (c, w) != (nclasses, width):
+            counts = np.zeros((nclasses, n, width), np.int64)
+            counts[:c, :, :w] = self.counts
+            self.counts = counts
+            def extend(array):
+                grown = np.zeros((nclasses,) + array.shape[1:], array.dtype)
+                grown[:c] = array
+                return grown
+            self.class_counts = extend(self.class_counts)
+            self.means, self.m2 = extend(self.means), extend(self.m2)
+
+    def compute_log_probs(self):
+        """Turn the counts into log P (see P) for every [class, input, value
+        code], the unseen-value slots included, and the variances into the
+        terms of the normal log-density.  Variances get 1e-9 of the largest
+        one added, so a constant input can't give a zero variance."""
+        sizes = np.array([len(self.values[a]) for a in self.discrete])
+        self.log_probs = np.log(self.counts + 1.0) - \
+            np.log(self.class_counts[:, None, None] + sizes[None, :, None] + 0.0)
+        var = self.m2 / np.maximum(self.class_counts, 1)[:, None]
+        var += 1e-9 * (var.max() if var.size and var.max() > 0 else 1.0)
+        self.log_norms = -0.5 * np.log(2 * np.pi * var)
+        self.precisions = 0.5 / var
+
+    def gaussian_scores(self, numbers):
+        """Return the summed normal log-densities of the continuous inputs
+        numbers (one row per example) for each class, as a class x example
+        array."""
+        scores = np.zeros((len(self.class_counts), len(numbers)))
+        for k in range(len(self.continuous)):
+            scores += self.log_norms[:, k, None] - self.precisions[:, k, None] * \
+                      (numbers[None, :, k] - self.means[:, k, None])**2
+        return scores
 
     def N(self, targetval, attr, attrval):
        "Return the count in the training data of this combination."
        try:
-          return self._N[targetval][attr][attrval]
-       except KeyError:
+          c = self.index[self.target][targetval]
+          if attrval is None:
+             return self.class_counts[c]
+          return self.counts[c, self.discrete.index(attr), self.index[attr][attrval]]
+       except (KeyError, ValueError):
           return 0
 
     def P(self, targetval, attr, attrval):
         """Smooth the raw counts to give a probability estimate.
-        Estimate adds 1 to numerator and len(possible vals) to denominator."""
+        Estimate adds 1 to numerator and len(possible vals) to denominator.
+        For a continuous input, give the normal density at attrval."""
+        if attr in self.continuous:
+            c = self.index[self.target][targetval]
+            k = self.continuous.index(attr)
+            return math.exp(self.log_norms[c, k] - self.precisions[c, k] *
+                            (attrval - self.means[c, k])**2)
         return ((self.N(targetval, attr, attrval) + 1.0) /
-                (self.N(targetval, attr, None) + len(self.dataset.values[attr])))
+                (self.N(targetval, attr, None) + len(self.values[attr])))
 
     def predict(self, example):
         """Predict the target value for example. Consider each possible value,
-        choose the most likely, by looking at each attribute independently."""
-        possible_values = self.dataset.values[self.dataset.target]
-        def class_probability(targetval):
-            return product([self.P(targetval, a, example[a])
-                            for a in self.dataset.inputs])  #removed ',1' from the arglist as product takes a list of vals to mult
-        return argmax(possible_values, class_probability)
+        choose the most likely, by looking at each attribute independently.
+        Probabilities are added up as logs, so wide examples can't underflow."""
+        unseen = self.counts.shape[2] - 1
+        codes = [self.index[a].get(example[a], unseen) for a in self.discrete]
+        scores = self.log_probs[:, np.arange(len(codes)), codes].sum(axis=1)
+        if self.continuous:
+            numbers = np.array([[example[a] for a in self.continuous]], np.float64)
+            scores += self.gaussian_scores(numbers)[:, 0]
+        return self.values[self.target][np.argmax(scores)]
+
+    def predict_batch(self, codes):
+        """Predict the target value of each row of a code matrix (in the
+        dictionary of the dataset trained on), one input column at a time."""
+        scores = np.zeros((len(self.class_counts), len(codes)))
+        for j, a in enumerate(self.discrete):
+            scores += self.log_probs[:, j, codes[:, a]]
+        if self.continuous:
+            numbers = np.column_stack(
+                [np.array(self.dataset.values[a], np.float64)[codes[:, a]]
+                 for a in self.continuous])
+            scores += self.gaussian_scores(numbers)
+        targetvals = self.values[self.target]
+        return [targetvals[c] for c in np.argmax(scores, axis=0).tolist()]
 
 #______________________________________________________________________________
 
 class NearestNeighborLearner(Learner):
 
-    def __init__(self, k=1):
-        "k-NearestNeighbor: the k nearest neighbors vote."
+    def __init__(self, k=1, metric='hamming', index='auto', leaf_size=16,
+                 tables=10, bits=None):
+        """k-NearestNeighbor: the k nearest neighbors vote.
+        metric is 'hamming' (the fraction of inputs that differ, like
+        mean_boolean_error), 'euclidean' or 'manhattan' (for numeric inputs),
+        or a function giving the distances from each row of a matrix of
+        encoded examples (see encode) to one encoded example.  index is 'kd'
+        for a KDTree, 'ball' for a BallTree, 'lsh' for an (approximate)
+        LSHIndex, None to scan every example, a function (points, metric)
+        returning an index like these, or 'auto': a KDTree when the metric
+        is euclidean or manhattan and every input is numeric, a BallTree for
+        a metric function, and otherwise a scan (hamming distances take so
+        few values that ties keep the trees from pruning much).  leaf_size
+        is passed to a KDTree or BallTree, tables and bits to an LSHIndex.
+        A subclass overriding distance(e1, e2) has that used as the metric
+        instead, on the examples the rows stand for (see ExampleMetric)."""
         self.k = k
+        self.metric = metric
+        self.index = index
+        self.leaf_size = leaf_size
+        self.tables = tables
+        self.bits = bits
+
+    def train(self, dataset):
+        """Encode the training examples as a matrix, one row per example
+        and one column per input, and build the index over it."""
+        self.dataset = dataset
+        self.numeric = [dataset.is_numeric(a) for a in dataset.inputs]
+        self.points = np.column_stack(
+            [dataset.column(a) for a in dataset.inputs]).astype(np.float64)
+        self.classes = dataset.target_codes()
+        ## The metric in use: self.metric, unless distance is overridden
+        self.measure = self.metric
+        if self.__class__.distance.im_func is not \
+           NearestNeighborLearner.distance.im_func:
+            self.measure = ExampleMetric(self)
+        index = self.index
+        if index == 'auto':
+            if self.measure in ('euclidean', 'manhattan') and all(self.numeric):
+                index = 'kd'
+            elif callable(self.measure):
+                index = 'ball'
+            else:
+                index = None
+        if index == 'kd':
+            self.tree = KDTree(self.points, self.measure, self.leaf_size)
+        elif index == 'ball':
+            self.tree = BallTree(self.points, self.measure, self.leaf_size)
+        elif index == 'lsh':
+            self.tree = LSHIndex(self.points, self.measure, self.tables, self.bits)
+        elif callable(index):
+            self.tree = index(self.points, self.measure)
+        else:
+            self.tree = BallTree(self.points, self.measure, len(self.points))
+
+    def encode(self, example):
+        """Return example's inputs as a row of numbers: numeric values as
+        themselves, other values as their codes, or -1 if never seen."""
+        row = np.empty(len(self.numeric))
+        for j, a in enumerate(self.dataset.inputs):
+            if self.numeric[j]:
+                row[j] = example[a]
+            else:
+                row[j] = self.dataset.value_index(a).get(example[a], -1)
+        return row
+
+    def decode(self, row):
+        """Return the example a row of encode's stands for, with None for
+        the attributes that aren't inputs and for codes of -1.  Codes that
+        aren't whole (a BallTree's centers) are rounded."""
+        example = [None] * len(self.dataset.values)
+        for j, a in enumerate(self.dataset.inputs):
+            if self.numeric[j]:
+                example[a] = row[j]
+            elif row[j] >= 0:
+                example[a] = self.dataset.values[a][int(round(row[j]))]
+        return example
 
     def predict(self, example):
         """With k=1, find the point closest to example.
-        With k>1, find k closest, and have them vote for the best."""
-        if self.k == 1:
-            neighbor = argmin(self.dataset.examples,
-                              lambda e: self.distance(e, example))
-            return neighbor[self.dataset.target]
-        else:
-            ## Maintain a sorted list of (distance, example) pairs.
-            ## For very large k, a PriorityQueue would be better
-            best = [] 
-            for e in self.dataset.examples:
-                d = self.distance(e, example)
-                if len(best) < self.k: 
-                    best.append((d, e))
-                elif d < best[-1][0]:
-                    best[-1] = (d, e)
-                    best.sort()
-            return mode([e[self.dataset.target] for (d, e) in best])
+        With k>1, find k closest, and have them vote for the best.
+        The index prunes the parts of the training set that can't hold
+        anything closer than the k best found so far; ties go to the
+        example that comes first."""
+        nearest = self.tree.search(self.encode(example), self.k)
+        classes = self.classes[[i for (d, i) in nearest]]
+        targetvals = self.dataset.values[self.dataset.target]
+        return targetvals[vote(classes[None, :], len(targetvals))[0]]
+
+    def encode_codes(self, codes):
+        """Encode each row of a code matrix (in the dictionary of the
+        dataset trained on) like encode."""
+        points = np.empty((len(codes), len(self.numeric)))
+        for j, a in enumerate(self.dataset.inputs):
+            if self.numeric[j]:
+                table = np.array(self.dataset.values[a], np.float64)
+                points[:, j] = table[codes[:, a]]
+            else:
+                points[:, j] = codes[:, a]
+        return points
+
+    tile = 2**20  # the most query x training distances to hold at once
+
+    def predict_batch(self, codes):
+        """Predict the target value of each row of a code matrix, scanning
+        the training set for a tile of queries at a time: compute the block
+        of their distances to every training example, then pick out each
+        query's k nearest by partial selection rather than sorting.  The
+        neighbors (ties included) are the ones predict would find.  An
+        approximate index is searched one query at a time instead."""
+        queries = self.encode_codes(codes)
+        targetvals = self.dataset.values[self.dataset.target]
+        if not self.tree.exact:
+            nearest = [[i for (d, i) in self.tree.search(q, self.k)]
+                       for q in queries]
+            votes = vote(self.classes[np.array(nearest, int)], len(targetvals))
+            return [targetvals[c] for c in votes.tolist()]
+        rows = max(1, self.tile // max(len(self.points), 1))
+        encoded = None
+        if self.measure == 'hamming':
+            encoded = one_hot(self.points, self.points)
+        classes = [self.classes[self.nearest(queries[i:i+rows], encoded)]
+                   for i in range(0, len(queries), rows)]
+        votes = vote(np.concatenate(classes), len(targetvals))
+        return [targetvals[c] for c in votes.tolist()]
+
+    def nearest(self, queries, encoded=None):
+        """Return the rows of the k training points nearest to each of the
+        queries, nearest first, equally distant ones in row order.  For
+        hamming, encoded may give one_hot(self.points, self.points)."""
+        D = distance_block(self.points, queries, self.measure, encoded)
+        k = min(self.k, len(self.points))
+        kth = np.partition(D, k - 1, axis=1)[:, k - 1:k]
+        ## Everything nearer than the kth distance, then the first few at it
+        at_kth = D == kth
+        chosen = (D < kth) | at_kth & \
+                 (np.cumsum(at_kth, axis=1) <= k - (D < kth).sum(axis=1)[:, None])
+        rows = np.nonzero(chosen)[1].reshape(len(queries), k)
+        order = np.argsort(D[np.arange(len(queries))[:, None], rows],
+                           axis=1, kind='mergesort')
+        return rows[np.arange(len(queries))[:, None], order]
 
     def distance(self, e1, e2):
+        """The distance between two examples, for subclasses to override;
+        this one, like the hamming metric, is the fraction that differ."""
         return mean_boolean_error(e1, e2)
 
 #______________________________________________________________________________
@@ -99,15 +372,62 @@ class NearestNeighborLearner(Learner):
 class EnsembleLearner(Learner):
     """Given a list of learning algorithms, have them vote."""
 
-    def __init__(self, learners=[]):
-        self.learners=learners
+    def __init__(self, learners=[], weights=None, processes=1):
+        """weights, if given, says how much each learner's vote counts.
+        With processes other than 1 the learners are trained, and batches
+        of examples predicted, in a pool of processes (see pool_map)."""
+        self.learners = learners
+        self.weights = weights
+        self.processes = processes
 
     def train(self, dataset):
+        """Train every learner on dataset.  Learners trained in a pool
+        come back as copies, which replace the originals in self.learners."""
+        self.dataset = dataset
+        self.learners = pool_map(train_member, range(len(self.learners)),
+                                 self.processes, learners=self.learners,
+                                 dataset=dataset)
         for learner in self.learners:
-           learner.train(dataset)
+            learner.dataset = dataset
 
     def predict(self, example):
-        return mode([learner.predict(example) for learner in self.learners])
+        return self.vote([[learner.predict(example)] for learner in self.learners])[0]
+
+    def predict_batch(self, codes):
+        """Predict the target value of each row of a code matrix: have each
+        learner predict the whole batch, and count all the votes at once."""
+        return self.vote(pool_map(predict_member, range(len(self.learners)),
+                                  self.processes, learners=self.learners,
+                                  codes=codes))
+
+    def vote(self, predictions):
+        """Given each learner's list of predictions, return the value with
+        the most (weighted) votes for each example; ties go to the value
+        that comes first in the dataset."""
+        targetvals = self.dataset.values[self.dataset.target] + [None]
+        index = self.dataset.value_index(self.dataset.target)
+        weights = self.weights or [1] * len(self.learners)
+        votes = np.array([[index.get(p, len(targetvals) - 1) for p in column]
+                          for column in predictions], np.int32)
+        scores = np.zeros((votes.shape[1], len(targetvals)))
+        rows = np.arange(votes.shape[1])
+        for learner_votes, weight in zip(votes, weights):
+            scores[rows, learner_votes] += weight
+        return [targetvals[c] for c in scores.argmax(axis=1).tolist()]
+
+def train_member(i):
+    "Train the i'th learner of an EnsembleLearner, for pool_map."
+    learner = shared['learners'][i]
+    learner.train(shared['dataset'])
+    return learner
+
+def predict_member(i):
+    """Predict the batch of codes with the i'th learner of an EnsembleLearner,
+    for pool_map; learners without predict_batch predict row by row."""
+    learner, codes = shared['learners'][i], shared['codes']
+    if hasattr(learner, 'predict_batch'):
+        return list(learner.predict_batch(codes))
+    return map(learner.predict, learner.dataset.examples.decode(codes))
 
 #______________________________________________________________________________
 
@@ -13,15 +13,20 @@ import sys
 sys.path.append('source/')
 
 from utils import *
-import agents, random, operator
+import agents, random, operator, itertools
+import os, mmap, struct, hashlib, cPickle
+import numpy as np
 
 #______________________________________________________________________________
 
-class DataSet:
+class DataSet(object):
     """A data set for a machine learning problem.  It has the following fields:
 
-    d.examples    A list of examples (including both inputs and outputs).  
-                  Each one is a list of attribute values.
+    d.examples    A sequence of examples (including both inputs and outputs).
+                  Each one is a list of attribute values.  The examples are
+                  stored column by column (see below) and d.examples is a
+                  view that decodes rows on demand; assigning a list of
+                  rows to d.examples re-encodes it.
     d.attrs       A list of integers to index into an example, so example[attr]
                   gives a value. Normally the same as range(len(d.examples)). 
     d.attrnames   Optional list of mnemonic names for corresponding attrs 
@@ -40,14 +45,29 @@ class DataSet:
     d.name        Name of the data set (for output display only).
     d.source      URL or other source where the data came from.
 
+    Internally every attribute is dictionary-encoded: the value of attribute
+    a in example i is d.values[a][code], where code is an int32 held in one
+    contiguous array per attribute.  Learners that want to avoid walking
+    rows can ask for these arrays directly:
+
+    d.column(attr)         The typed array for one attribute: float64 or
+                           int32 values for numeric attributes, int32 codes
+                           into d.values[attr] for symbolic ones.
+    d.code_matrix(attrs)   An int32 matrix of codes, one row per example and
+                           one column per attr (all attributes by default).
+    d.target_codes()       The codes of the target attribute.
+
     Normally, you call the constructor and you're done; then you just
     access fields like d.examples and d.target and d.inputs."""
 
     def __init__(self, examples=None, attrs=None, target=-1, values=None,
                  attrnames=None, name='', source='',
-                 inputs=None, exclude=(), doc=''):
-        """Accepts any of DataSet's fields.  Examples can also be a string 
-        or file from which to parse examples using parse_csv.
+                 inputs=None, exclude=(), doc='', cache=True):
+        """Accepts any of DataSet's fields.  Examples can also be a string
+        from which to parse examples using parse_csv, or an open file which
+        is read a chunk at a time with read_csv.  If examples is None they
+        come from the data file 'name'.csv, by way of its binary cache
+        (see load_cache) unless cache is false.
         >>> DataSet(examples='1, 2, 3')
         <DataSet(): 1 examples, 3 attributes>
         """
@@ -60,21 +80,21 @@ class DataSet:
         if isinstance(examples, str):
             #if the examples passed in are an actual string, then just
             #   parse them.
-            self.examples = parse_csv(examples)
-        elif examples is None:
+            examples = parse_csv(examples)
+
+        #encode the examples into columns.  This also checks that their
+        #  values are in the right range for each attribute (raising
+        #  ValueError if not) and computes .values if it wasn't given.
+        if examples is None:
             #if no examples are passed in, assume that the examples are 
-            #  stored in a file named 'name'.csv.
-            self.examples = parse_csv(DataFile(name+'.csv').read())
+            #  stored in a file named 'name'.csv, and stream them in so 
+            #  the raw text is never held in memory.
+            self._load_datafile(name+'.csv', attrnames, cache)
+        elif isinstance(examples, file):
+            self._store(self._encode_chunks(read_csv(examples)))
         else:
-            #otherwise, assume that the examples sent in were in the 
-            #  appropriate list format
             self.examples = examples
         
-        #check to make sure that the examples have been read in properly,
-        #  mostly just that their values are in the right range for each
-        #  attribute
-        map(self.check_example, self.examples)
-        
         # Attrs are the indicies of examples, unless otherwise stated.
         if not attrs and self.examples:
             attrs = range(len(self.examples[0]))
@@ -140,7 +160,150 @@ class DataSet:
     def add_example(self, example):
         """Add an example to the list of examples, checking it first."""
         self.check_example(example)
-        self.examples.append(example)
+        row = self.encode_example(example).reshape(1, -1)
+        self._store(np.asfortranarray(np.concatenate((self._codes, row))))
+
+    #__________________________________________________________________________
+    # Columnar storage
+
+    def _get_examples(self):
+        return Examples(self)
+
+    def _set_examples(self, examples):
+        if isinstance(examples, Examples) and examples.values is self.values \
+           and examples.indices is None:
+            # Restoring a view we handed out earlier: reuse its storage.
+            self._store(examples.codes)
+        else:
+            self._store(self._encode(examples))
+
+    examples = property(_get_examples, _set_examples)
+
+    def _encode(self, examples):
+        """Dictionary-encode a list of examples into an int32 code matrix,
+        one contiguous column per attribute."""
+        return self._encode_chunks([list(examples)])
+
+    def _encode_chunks(self, chunks):
+        """Encode an iterable of lists of examples (such as read_csv yields)
+        into an int32 code matrix, one chunk at a time.  If self.values
+        wasn't given it is grown as new values turn up, and put in the same
+        order as unique() would give at the end."""
+        fixed = bool(self.values)
+        blocks = []
+        for chunk in chunks:
+            if not chunk:
+                continue
+            if not self.values:
+                self.values = [[] for a in chunk[0]]
+                self._index = None
+            block = np.empty((len(chunk), len(self.values)), np.int32, 'F')
+            for a, column in enumerate(zip(*chunk)):
+                index = self.value_index(a)
+                if not fixed:
+                    vals = self.values[a]
+                    for v in column:
+                        if v not in index:
+                            index[v] = len(vals)
+                            vals.append(v)
+                try:
+                    block[:, a] = [index[v] for v in column]
+                except KeyError, e:
+                    example = chunk[column.index(e.args[0])]
+                    raise ValueError('Bad value %s for attribute %s in %s' %
+                                     (e.args[0], a, example))
+            blocks.append(block)
+        if not blocks:
+            return np.empty((0, len(self.values or [])), np.int32, 'F')
+        codes = np.asfortranarray(np.concatenate(blocks))
+        if not fixed:
+            for a, vals in enumerate(self.values):
+                ordered = unique(vals)
+                recode = np.empty(len(ordered), np.int32)
+                recode[map(self.value_index(a).get, ordered)] = \
+                    np.arange(len(ordered))
+                codes[:, a] = recode[codes[:, a]]
+                self.values[a] = ordered
+            self._index = None
+        return codes
+
+    def _store(self, codes):
+        "Make codes the storage of this DataSet, dropping derived columns."
+        self._codes = codes
+        self._numeric = {}
+
+    def _load_datafile(self, filename, attrnames=None, cache=True):
+        """Load the examples of a file in the data directory.  With cache,
+        and no values given, they are memory-mapped from its binary cache,
+        which is (re)built from the file if it is missing or out of date."""
+        path = data_path(filename)
+        if not cache or self.values:
+            with open(path) as f:
+                self._store(self._encode_chunks(read_csv(f)))
+            return
+        cached = load_cache(path)
+        if cached:
+            self.values, codes, numeric = cached
+            self._store(codes)
+            self._numeric = numeric
+            return
+        with open(path) as f:
+            self._store(self._encode_chunks(read_csv(f)))
+        numeric = dict((a, self.column(a)) for a in range(len(self.values))
+                       if self.is_numeric(a))
+        try:
+            save_cache(path, self.values, self._codes, numeric, attrnames)
+        except (IOError, OSError):
+            pass # The cache is only an optimization.
+
+    def value_index(self, attr):
+        "Return a dict mapping each value of attr to its code."
+        if getattr(self, '_index', None) is None:
+            self._index = [dict(zip(vals, range(len(vals))))
+                           for vals in self.values]
+        return self._index[attr]
+
+    def encode_example(self, example):
+        "Return the codes of an example as an int32 array."
+        return np.array([self.value_index(a)[v] for a, v in enumerate(example)],
+                        np.int32)
+
+    def is_numeric(self, attr):
+        "Are all the values of attr numbers?"
+        values = self.values[self.attrnum(attr)]
+        return bool(values) and every(isnumber, values) and \
+               not some(lambda v: isinstance(v, bool), values)
+
+    def column(self, attr):
+        """Return the typed array of values for attr (a name or index):
+        float64 or int32 numbers if the attribute is numeric (int64, or
+        float64 past that, for integers outside the int32 range), else the
+        int32 codes into self.values[attr].  Don't modify it."""
+        attr = self.attrnum(attr)
+        if not self.is_numeric(attr):
+            return self._codes[:, attr]
+        if attr not in self._numeric:
+            values = self.values[attr]
+            if every(lambda v: isinstance(v, (int, long)), values) and \
+               -2**63 <= min(values) and max(values) < 2**63:
+                table = np.array(values, np.int64)
+                if -2**31 <= table.min() and table.max() < 2**31:
+                    table = table.astype(np.int32)
+            else:
+                table = np.array(values, np.float64)
+            self._numeric[attr] = table[self._codes[:, attr]]
+        return self._numeric[attr]
+
+    def code_matrix(self, attrs=None):
+        """Return the int32 codes of attrs (default all attributes) as a
+        matrix with one row per example and one column per attr."""
+        if attrs is None:
+            return self._codes
+        return self._codes[:, map(self.attrnum, attrs)]
+
+    def target_codes(self):
+        "Return the codes of the target attribute, one per example."
+        return self._codes[:, self.target]
 
     def check_example(self, example):
         """Raise ValueError if example has any invalid values."""
@@ -169,6 +332,242 @@ class DataSet:
 
 #______________________________________________________________________________
 
+class Examples(object):
+    """The examples of a DataSet, as a sequence of rows decoded on demand
+    from its code matrix.  Each row is a fresh list of attribute values, so
+    callers can use it just like the lists DataSet used to store.  Setting a
+    row writes its codes back into the DataSet.  If indices is given, the
+    sequence holds just the examples at those indices, in that order."""
+
+    def __init__(self, dataset, indices=None):
+        self.dataset = dataset
+        self.codes = dataset._codes
+        self.values = dataset.values
+        self.indices = indices
+        self.tables = None
+
+    def __len__(self):
+        if self.indices is not None:
+            return len(self.indices)
+        return len(self.codes)
+
+    def rows(self, i):
+        "Return the codes of the i'th example(s); i can be a slice."
+        if self.indices is not None:
+            return self.codes[self.indices[i]]
+        return self.codes[i]
+
+    def decode(self, codes):
+        "Turn a matrix of codes into a list of rows of values."
+        if self.tables is None:
+            self.tables = []
+            for vals in self.values:
+                table = np.empty(len(vals), object)
+                table[:] = vals
+                self.tables.append(table)
+        rows = np.empty(codes.shape, object)
+        for a, table in enumerate(self.tables):
+            rows[:, a] = table[codes[:, a]]
+        return rows.tolist()
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.decode(self.rows(i))
+        return self.decode(self.rows(i).reshape(1, -1))[0]
+
+    def __setitem__(self, i, example):
+        if not self.codes.flags.writeable:
+            # Memory-mapped from a cache: copy on first write.
+            codes = np.array(self.codes, order='F')
+            if self.dataset._codes is self.codes:
+                self.dataset._store(codes)
+            self.codes = codes
+        if self.indices is not None:
+            i = self.indices[i]
+        self.codes[i] = self.dataset.encode_example(example)
+        self.dataset._numeric = {}
+
+    def __iter__(self, chunksize=1024):
+        for start in xrange(0, len(self), chunksize):
+            for row in self.decode(self.rows(slice(start, start+chunksize))):
+                yield row
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def append(self, example):
+        self.dataset.add_example(example)
+
+    def __repr__(self):
+        return repr(list(self))
+
+#______________________________________________________________________________
+
+class DataSetView(object):
+    """Some of the examples of a DataSet, picked out by index rather than
+    copied.  The view holds order, a permutation of the example indices
+    (which may be shared by many views), and ranges, a list of (start, end)
+    pairs; its examples are those at order[start:end] for each range, in
+    turn.  A view never changes the DataSet, so one DataSet can back many
+    views (say, the folds of a cross-validation) at once.
+
+    A view can be passed to a learner's train in place of the DataSet: its
+    other fields (target, inputs, values, ...) are those of the DataSet, and
+    examples, column, code_matrix and target_codes cover just its examples."""
+
+    def __init__(self, dataset, order=None, ranges=None):
+        if isinstance(dataset, DataSetView):
+            base = dataset.indices()
+            order = base if order is None else base[order]
+            dataset = dataset.dataset
+        if order is None:
+            order = np.arange(len(dataset.examples))
+        self.dataset = dataset
+        self.order = np.asarray(order)
+        if ranges is None:
+            ranges = [(0, len(self.order))]
+        self.ranges = [(start, end) for (start, end) in ranges if end > start]
+
+    def __getattr__(self, attr):
+        if attr.startswith('__') or attr == 'dataset':
+            raise AttributeError(attr)
+        return getattr(self.dataset, attr)
+
+    def __len__(self):
+        return sum([end - start for (start, end) in self.ranges])
+
+    def indices(self):
+        "Return the indices of the examples in this view, in order."
+        if len(self.ranges) == 1:
+            start, end = self.ranges[0]
+            return self.order[start:end]
+        return np.concatenate([self.order[start:end]
+                               for (start, end) in self.ranges] or
+                              [np.zeros(0, self.order.dtype)])
+
+    def split(self, k):
+        """Return two views sharing this one's order: of the first k
+        examples, and of the rest."""
+        first, rest = [], []
+        for (start, end) in self.ranges:
+            taken = max(0, min(end - start, k))
+            first.append((start, start + taken))
+            rest.append((start + taken, end))
+            k -= taken
+        return (DataSetView(self.dataset, self.order, first),
+                DataSetView(self.dataset, self.order, rest))
+
+    @property
+    def examples(self):
+        return Examples(self.dataset, self.indices())
+
+    def column(self, attr):
+        "The column of attr (see DataSet.column) for the examples of the view."
+        return self.dataset.column(attr)[self.indices()]
+
+    def code_matrix(self, attrs=None):
+        "The code matrix (see DataSet.code_matrix) of the view's examples."
+        return self.dataset.code_matrix(attrs)[self.indices()]
+
+    def target_codes(self):
+        "The codes of the target attribute, one per example of the view."
+        return self.dataset.target_codes()[self.indices()]
+
+    def __repr__(self):
+        return '<DataSetView(%s): %d of %d examples>' % (
+            self.dataset.name, len(self), len(self.dataset.examples))
+
+#______________________________________________________________________________
+
+def read_csv(input, delim=',', chunksize=1000, types=None, sample=100):
+    r"""Input is an open file (or any iterable of lines), each line has 
+    comma-delimited fields.  Yield lists of at most chunksize converted rows,
+    reading lines as they are needed.  Blank lines are skipped.
+    Unless types (a list of int, float, str or None per column) is given, 
+    the type of each column is inferred once from the first sample rows by
+    infer_types.  Cells that don't fit their column's type, and cells of 
+    columns of type None, are converted with num_or_str.
+    >>> list(read_csv(['1, 2, a', '', ' 0, 2.5, b '], chunksize=1))
+    [[[1, 2, 'a']], [[0, 2.5, 'b']]]
+    >>> list(read_csv(['a, 1', ' 5 , 2'], sample=1))
+    [[['a', 1], [5, 2]]]
+    """
+    lines = (line.strip() for line in input)
+    rows = (line.split(delim) for line in lines if line)
+    head = list(itertools.islice(rows, sample))
+    if types is None:
+        types = infer_types(head)
+    converters = map(converter, types)
+    def convert(cells):
+        if len(cells) != len(converters):
+            return map(num_or_str, cells)
+        return [convert_cell(cell) for convert_cell, cell in
+                zip(converters, cells)]
+    rows = itertools.chain(head, rows)
+    while True:
+        chunk = map(convert, itertools.islice(rows, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+def infer_types(rows):
+    """Given a sample of rows of string cells, return the type of each 
+    column: int or float if every cell is such a number, str if none is a 
+    number, and None (meaning mixed) otherwise.
+    >>> infer_types([['1', '2.5', 'a', 'na'], ['2', '3', 'b', '4']])
+    [<type 'int'>, <type 'float'>, <type 'str'>, None]
+    """
+    def kind(cell):
+        for number in (int, float):
+            try:
+                number(cell)
+                return number
+            except ValueError:
+                pass
+        return str
+    types = []
+    for column in zip(*rows):
+        kinds = set(map(kind, column))
+        if kinds == set([int]): types.append(int)
+        elif kinds <= set([int, float]): types.append(float)
+        elif kinds == set([str]): types.append(str)
+        else: types.append(None)
+    return types
+
+def converter(type):
+    """Return a function converting a string cell to the given column type
+    (see read_csv).  Cells that don't fit the type go through num_or_str."""
+    if type is str:
+        # Only cells starting like a number, or spelling inf or nan, can
+        # be one.
+        def convert(cell):
+            cell = cell.strip()
+            first = cell[:1]
+            if first and (first in '0123456789+-.' or first in 'iInN' and
+                          cell.lower() in ('inf', 'infinity', 'nan')):
+                return num_or_str(cell)
+            return cell
+        return convert
+    elif type is None:
+        return num_or_str
+    elif type is float:
+        # Like num_or_str, keep the cells of a float column that are
+        # written as integers as ints.
+        def convert(cell):
+            try:
+                if '.' in cell or 'e' in cell or 'E' in cell or 'n' in cell:
+                    return float(cell)
+                return int(cell)
+            except ValueError:
+                return num_or_str(cell)
+        return convert
+    def convert(cell):
+        try:
+            return type(cell)
+        except ValueError:
+            return num_or_str(cell)
+    return convert
+
 def parse_csv(input, delim=','):
     r"""Input is a string consisting of lines, each line has comma-delimited 
     fields.  Convert this into a list of lists.  Blank lines are skipped.
@@ -197,26 +596,212 @@ def parse_csv(input, delim=','):
     return lines
 
 #______________________________________________________________________________
-# The rest of this file gives Data sets for machine learning problems.
+# The binary dataset cache.  A data file such as data/mushroom.csv is parsed
+# once into data/mushroom.cache, holding its code matrix, its numeric columns
+# and its values.  Later loads memory-map the cache, so they cost next to
+# nothing and processes reading the same data set share its pages.
+#
+# The layout is the magic string, the length of a pickled header, the header
+# (values, attrnames, shape, array offsets and the stamp of the csv file it
+# was built from), then the arrays, each aligned to 16 bytes.
 
-orings = DataSet(name='orings', target='Distressed',
-                 attrnames="Rings Distressed Temp Pressure Flightnum")
+cache_magic = 'DSCACHE1'
 
+def data_path(name):
+    "Return the path of a file in the AIMA /data directory."
+    import utils
+    return os.path.join(os.path.dirname(utils.__file__), '..', 'data', name)
 
-zoo = DataSet(name='zoo', target='type', exclude=['name'],
-              attrnames="name hair feathers eggs milk airborne aquatic " +
-              "predator toothed backbone breathes venomous fins legs tail " +
-              "domestic catsize type")
+def cache_path(path):
+    "Return the path of the binary cache of the data file at path."
+    return os.path.splitext(path)[0] + '.cache'
 
-iris = DataSet(name='iris', target='class', attrnames='sepal-length sepal-width petal-length petal-width class')
+def file_stamp(path):
+    "Return the (mtime, size) of a file."
+    info = os.stat(path)
+    return (info.st_mtime, info.st_size)
 
-restaurant = DataSet(name='restaurant', target='wait', attrnames='alt bar fri hun pat price rain res type est wait')
+def file_hash(path):
+    "Return the SHA-1 hex digest of a file's contents."
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), ''):
+            sha.update(block)
+    return sha.hexdigest()
 
-xor = DataSet(name='xor', target='out', attrnames = 'in1 in2 out')
+def save_cache(path, values, codes, numeric, attrnames=None):
+    """Write the binary cache for the data file at path, holding its values,
+    its code matrix and its numeric columns (a dict of attr: array)."""
+    arrays = [('codes', np.asfortranarray(codes))] + sorted(numeric.items())
+    header = dict(stamp=file_stamp(path), sha1=file_hash(path),
+                  values=values, attrnames=attrnames, shape=codes.shape,
+                  arrays=[])
+    offset = 0
+    for key, array in arrays:
+        header['arrays'].append((key, array.dtype.str, offset))
+        offset += -(-array.nbytes // 16) * 16
+    blob = cPickle.dumps(header, 2)
+    start = -(-(len(cache_magic) + 8 + len(blob)) // 16) * 16
+    tmp = '%s.%d.tmp' % (cache_path(path), os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(cache_magic + struct.pack('<Q', len(blob)) + blob)
+        for (key, dtype, offset), (key, array) in zip(header['arrays'], arrays):
+            f.seek(start + offset)
+            f.write(array.tostring(order='F'))
+    os.rename(tmp, cache_path(path))
 
-mush = DataSet(name='mushroom', target=0)
+def read_cache_header(path):
+    """Return the header of the binary cache for the data file at path, and
+    the open file, or None if there is no readable cache."""
+    try:
+        f = open(cache_path(path), 'rb')
+    except IOError:
+        return None
+    if f.read(len(cache_magic)) != cache_magic:
+        f.close()
+        return None
+    size, = struct.unpack('<Q', f.read(8))
+    return cPickle.loads(f.read(size)), f
+
+def load_cache(path):
+    """Memory-map the binary cache of the data file at path.  Return (values,
+    codes, numeric columns), or None if the cache is missing or was built 
+    from a different file.  A cache whose stamp is stale but whose content
+    hash still matches is reused and re-stamped."""
+    found = read_cache_header(path)
+    if not found:
+        return None
+    header, f = found
+    with f:
+        if header['stamp'] != file_stamp(path) and \
+           header['sha1'] != file_hash(path):
+            return None
+        start = -(-f.tell() // 16) * 16
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    arrays = {}
+    n, m = header['shape']
+    for key, dtype, offset in header['arrays']:
+        count = n * m if key == 'codes' else n
+        array = np.frombuffer(buf, dtype, count, start + offset)
+        arrays[key] = array.reshape((n, m), order='F') if key == 'codes' \
+                      else array
+    codes = arrays.pop('codes')
+    if header['stamp'] != file_stamp(path):
+        try:
+            save_cache(path, header['values'], codes, arrays,
+                       header['attrnames'])
+        except (IOError, OSError):
+            pass
+    return header['values'], codes, arrays
 
-tictactoe = DataSet(name='tic-tac-toe', target='win', attrnames='topleft topmiddle topright middleleft middlemiddle middleright bottomleft bottommiddle bottomright win')
 #______________________________________________________________________________
+# A registry of data sets that are only built the first time they are used,
+# so that importing this file doesn't parse every data file.
 
-    
+datasets = {}
+
+class LazyDataSet(object):
+    """Stands in for the DataSet built from the given constructor arguments.
+    The first time any of its fields or methods is used, it builds that 
+    DataSet and turns into it, so it costs nothing extra from then on."""
+
+    def __init__(self, **kwargs):
+        self.__dict__['_kwargs'] = kwargs
+
+    def load(self):
+        "Build the DataSet (if that wasn't done yet) and return it."
+        if isinstance(self, LazyDataSet):
+            kwargs = self._kwargs
+            object.__setattr__(self, '__class__', DataSet)
+            try:
+                del self._kwargs
+                DataSet.__init__(self, **kwargs)
+            except:
+                self.__dict__.clear()
+                self.__dict__['_kwargs'] = kwargs
+                self.__class__ = LazyDataSet
+                raise
+        return self
+
+    def size(self):
+        """Return (number of examples, number of attributes), without 
+        building the DataSet: from its examples if they were given, else
+        from the header of its binary cache if that is up to date, else by
+        counting the lines of its data file."""
+        examples = self._kwargs.get('examples')
+        if examples is not None:
+            if isinstance(examples, str):
+                examples = parse_csv(examples)
+            return len(examples), len(examples[0]) if examples else 0
+        path = data_path(self._kwargs['name'] + '.csv')
+        found = read_cache_header(path)
+        if found:
+            header, f = found
+            f.close()
+            if header['stamp'] == file_stamp(path):
+                return header['shape']
+        n, width = 0, 0
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    n += 1
+                    width = width or len(line.split(','))
+        return n, width
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        return getattr(self.load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self.load(), attr, value)
+
+    def __str__(self):
+        return str(self.load())
+
+    def __repr__(self):
+        return '<DataSet(%s): not loaded>' % self._kwargs.get('name', '')
+
+def register_dataset(**kwargs):
+    """Register a DataSet under kwargs['name'], to be built from kwargs the
+    first time it is used, and return the stand-in for it."""
+    datasets[kwargs['name']] = dataset = LazyDataSet(**kwargs)
+    return dataset
+
+def list_datasets():
+    """Return a sorted list of (name, number of examples, number of 
+    attributes, loaded?) for the registered data sets, loading none."""
+    def describe(name, dataset):
+        if isinstance(dataset, LazyDataSet):
+            return (name,) + tuple(dataset.size()) + (False,)
+        return (name, len(dataset.examples), len(dataset.values), True)
+    return [describe(name, dataset)
+            for name, dataset in sorted(datasets.items())]
+
+#______________________________________________________________________________
+# The rest of this file gives Data sets for machine learning problems.
+
+orings = register_dataset(name='orings', target='Distressed',
+                          attrnames="Rings Distressed Temp Pressure Flightnum")
+
+
+zoo = register_dataset(name='zoo', target='type', exclude=['name'],
+                       attrnames="name hair feathers eggs milk airborne aquatic " +
+                       "predator toothed backbone breathes venomous fins legs tail " +
+                       "domestic catsize type")
+
+iris = register_dataset(name='iris', target='class', attrnames='sepal-length sepal-width petal-length petal-width class')
+
+restaurant = register_dataset(name='restaurant', target='wait', attrnames='alt bar fri hun pat price rain res type est wait')
+
+xor = register_dataset(name='xor', target='out', attrnames = 'in1 in2 out')
+
+mush = register_dataset(name='mushroom', target=0)
+
+wine = register_dataset(name='wine', target='class',
+                        attrnames="class alcohol malic-acid ash alcalinity magnesium " +
+                        "phenols flavanoids nonflavanoid-phenols proanthocyanins " +
+                        "color-intensity hue OD280/OD315 proline")
+
+tictactoe = register_dataset(name='tic-tac-toe', target='win', attrnames='topleft topmiddle topright middleleft middlemiddle middleright bottomleft bottommiddle bottomright win')
+#______________________________________________________________________________
@@ -4,7 +4,7 @@ sys.path.append('source/')
 execfile("dataset.py")
 
 from utils import *
-import agents, random, operator
+import agents, random, operator, multiprocessing, heapq, time
 
 #______________________________________________________________________________
 
@@ -32,114 +32,833 @@ class Learner:
     def predict(self, example): 
         abstract
 
+    transient = ('dataset',)  # left out of a learner a pool worker returns
+
 class NaiveBayesLearner(Learner):
+
+    def __init__(self, gaussian=False):
+        """With gaussian, each numeric input is modelled by a normal
+        distribution for each target value, kept as a running mean and
+        variance, instead of counting every distinct number as a value."""
+        self.gaussian = gaussian
     
     def train(self, dataset):
         """Just count the target/attr/val occurences.
-        Count how many times each value of each attribute occurs.
-        Store count in N[targetvalue][attr][val]. Let N[attr][None] be the
-        sum over all vals."""
-        N = {}
+        Count how many times each value of each discrete input occurs with
+        each target value, in an array indexed by [target code, input number,
+        value code], the codes being positions in self.values (which starts
+        out as a copy of dataset.values).  It has one more value slot than
+        the widest input, which stays 0: the count for a value that was never
+        seen.  Continuous inputs get a mean and a sum of squared deviations
+        per target value instead.  Then compute the log-probabilities."""
         self.dataset = dataset
-        ## Initialize to 0
-        for gv in self.dataset.values[self.dataset.target]:
-            N[gv] = {}
-            for attr in self.dataset.attrs:
-                N[gv][attr] = {}
-                for val in self.dataset.values[attr]:
-                    N[gv][attr][val] = 0
-                    N[gv][attr][None] = 0
-        ## Go thru examples
-        for example in self.dataset.examples:
-            Ngv = N[example[self.dataset.target]]
-            for attr in self.dataset.attrs:
-                Ngv[attr][example[attr]] += 1
-                Ngv[attr][None] += 1
-        self._N = N
+        self.target, self.inputs = dataset.target, dataset.inputs
+        self.continuous = [a for a in self.inputs
+                           if self.gaussian and dataset.is_numeric(a)]
+        self.discrete = [a for a in self.inputs if a not in self.continuous]
+        self.values = [[] for vals in dataset.values]
+        self.index = [{} for vals in dataset.values]
+        self.counts = np.zeros((0, len(self.discrete), 1), np.int64)
+        self.class_counts = np.zeros(0, np.int64)
+        self.means = np.zeros((0, len(self.continuous)))
+        self.m2 = np.zeros((0, len(self.continuous)))
+        self.partial_fit(dataset)
+
+    def partial_fit(self, examples):
+        """Add examples to the counts of a trained learner: a DataSet, a
+        DataSetView, or a list of rows (such as a chunk from read_csv).
+        Values that haven't been seen before are added to self.values."""
+        if not hasattr(self, 'counts'):
+            raise ValueError('Train on a DataSet first, to set the target and inputs')
+        attrs = self.discrete + [self.target]
+        if hasattr(examples, 'code_matrix'):
+            ## Translate the dataset's codes into ours
+            matrix = examples.code_matrix(attrs)
+            codes = np.empty(matrix.shape, np.int32)
+            for j, a in enumerate(attrs):
+                recode = np.array([self.code(a, v) for v in examples.values[a]],
+                                  np.int32)
+                codes[:, j] = recode[matrix[:, j]]
+            numbers = [examples.column(a) for a in self.continuous]
+        else:
+            examples = list(examples)
+            codes = np.array([[self.code(a, example[a]) for a in attrs]
+                              for example in examples], np.int32)
+            codes = codes.reshape(-1, len(attrs))
+            numbers = [[example[a] for example in examples]
+                       for a in self.continuous]
+        self.grow()
+        classes, codes = codes[:, -1], codes[:, :-1]
+        nclasses, ninputs, width = self.counts.shape
+        ## One bincount over the flattened [class, input, value] index
+        cells = (classes[:, None] * ninputs + np.arange(ninputs)) * width + codes
+        self.counts += np.bincount(cells.ravel(), minlength=self.counts.size
+                                   ).reshape(self.counts.shape)
+        ## The mean and squared deviations of this batch, for each class
+        n = np.bincount(classes, minlength=nclasses)
+        means = np.zeros((nclasses, len(self.continuous)))
+        m2 = np.zeros((nclasses, len(self.continuous)))
+        for k, column in enumerate(numbers):
+            column = np.asarray(column, np.float64)
+            means[:, k] = np.bincount(classes, column, nclasses) / np.maximum(n, 1)
+            m2[:, k] = np.bincount(classes, (column - means[classes, k])**2, nclasses)
+        self.add_class_stats(np.arange(nclasses), n, means, m2)
+        self.compute_log_probs()
+        return self
+
+    def merge(self, other):
+        """Add the counts of other, a NaiveBayesLearner trained on other
+        examples with the same target and inputs, to this one's.  Values
+        are matched up by value, not code, so the learners may have been
+        trained on different DataSets.  Returns self."""
+        if (other.target, other.inputs, other.continuous) != \
+           (self.target, self.inputs, self.continuous):
+            raise ValueError('Can only merge learners with the same target and inputs')
+        recode = dict([(a, [self.code(a, v) for v in other.values[a]])
+                       for a in self.discrete + [self.target]])
+        self.grow()
+        classes = recode[self.target]
+        for j, a in enumerate(self.discrete):
+            self.counts[np.ix_(classes, [j], recode[a])] += \
+                other.counts[:, j:j+1, :len(recode[a])]
+        self.add_class_stats(classes, other.class_counts, other.means, other.m2)
+        self.compute_log_probs()
+        return self
+
+    def add_class_stats(self, classes, n, means, m2):
+        """Add n more examples of each of the target codes classes, whose
+        continuous inputs have the given means and sums of squared deviations
+        from them.  The running means and sums are combined by the pairwise
+        update of Chan et al. (Welford's, when adding a single example)."""
+        n_a = self.class_counts[classes][:, None].astype(np.float64)
+        n_b = np.asarray(n, np.float64)[:, None]
+        delta = means - self.means[classes]
+        total = np.maximum(n_a + n_b, 1)
+        self.means[classes] += delta * n_b / total
+        self.m2[classes] += m2 + delta**2 * n_a * n_b / total
+        self.class_counts[classes] += n
+
+    def code(self, attr, value):
+        "Return the code of value for attr, adding it to self.values if new."
+        index = self.index[attr]
+        if value not in index:
+            index[value] = len(self.values[attr])
+            self.values[attr].append(value)
+        return index[value]
+
+    def grow(self):
+        """Make room in the arrays for any target values and input values
+        added to self.values, keeping one spare slot for unseen values."""
+        nclasses = len(self.values[self.target])
+        width = max([len(self.values[a]) for a in self.discrete] + [0]) + 1
+        c, n, w = self.counts.shape
+        if (c, w) != (nclasses, width):
+            counts = np.zeros((nclasses, n, width), np.int64)
+            counts[:c, :, :w] = self.counts
+            self.counts = counts
+            def extend(array):
+                grown = np.zeros((nclasses,) + array.shape[1:], array.dtype)
+                grown[:c] = array
+                return grown
+            self.class_counts = extend(self.class_counts)
+            self.means, self.m2 = extend(self.means), extend(self.m2)
+
+    def compute_log_probs(self):
+        """Turn the counts into log P (see P) for every [class, input, value
+        code], the unseen-value slots included, and the variances into the
+        terms of the normal log-density.  Variances get 1e-9 of the largest
+        one added, so a constant input can't give a zero variance."""
+        sizes = np.array([len(self.values[a]) for a in self.discrete])
+        self.log_probs = np.log(self.counts + 1.0) - \
+            np.log(self.class_counts[:, None, None] + sizes[None, :, None] + 0.0)
+        var = self.m2 / np.maximum(self.class_counts, 1)[:, None]
+        var += 1e-9 * (var.max() if var.size and var.max() > 0 else 1.0)
+        self.log_norms = -0.5 * np.log(2 * np.pi * var)
+        self.precisions = 0.5 / var
+
+    def gaussian_scores(self, numbers):
+        """Return the summed normal log-densities of the continuous inputs
+        numbers (one row per example) for each class, as a class x example
+        array."""
+        scores = np.zeros((len(self.class_counts), len(numbers)))
+        for k in range(len(self.continuous)):
+            scores += self.log_norms[:, k, None] - self.precisions[:, k, None] * \
+                      (numbers[None, :, k] - self.means[:, k, None])**2
+        return scores
 
     def N(self, targetval, attr, attrval):
        "Return the count in the training data of this combination."
        try:
-          return self._N[targetval][attr][attrval]
-       except KeyError:
+          c = self.index[self.target][targetval]
+          if attrval is None:
+             return self.class_counts[c]
+          return self.counts[c, self.discrete.index(attr), self.index[attr][attrval]]
+       except (KeyError, ValueError):
           return 0
 
     def P(self, targetval, attr, attrval):
         """Smooth the raw counts to give a probability estimate.
-        Estimate adds 1 to numerator and len(possible vals) to denominator."""
+        Estimate adds 1 to numerator and len(possible vals) to denominator.
+        For a continuous input, give the normal density at attrval."""
+        if attr in self.continuous:
+            c = self.index[self.target][targetval]
+            k = self.continuous.index(attr)
+            return math.exp(self.log_norms[c, k] - self.precisions[c, k] *
+                            (attrval - self.means[c, k])**2)
         return ((self.N(targetval, attr, attrval) + 1.0) /
-                (self.N(targetval, attr, None) + len(self.dataset.values[attr])))
+                (self.N(targetval, attr, None) + len(self.values[attr])))
 
     def predict(self, example):
         """Predict the target value for example. Consider each possible value,
-        choose the most likely, by looking at each attribute independently."""
-        possible_values = self.dataset.values[self.dataset.target]
-        def class_probability(targetval):
-            return product([self.P(targetval, a, example[a])
-                            for a in self.dataset.inputs])  #removed ',1' from the arglist as product takes a list of vals to mult
-        return argmax(possible_values, class_probability)
+        choose the most likely, by looking at each attribute independently.
+        Probabilities are added up as logs, so wide examples can't underflow."""
+        unseen = self.counts.shape[2] - 1
+        codes = [self.index[a].get(example[a], unseen) for a in self.discrete]
+        scores = self.log_probs[:, np.arange(len(codes)), codes].sum(axis=1)
+        if self.continuous:
+            numbers = np.array([[example[a] for a in self.continuous]], np.float64)
+            scores += self.gaussian_scores(numbers)[:, 0]
+        return self.values[self.target][np.argmax(scores)]
+
+    def predict_batch(self, codes):
+        """Predict the target value of each row of a code matrix (in the
+        dictionary of the dataset trained on), one input column at a time."""
+        scores = np.zeros((len(self.class_counts), len(codes)))
+        for j, a in enumerate(self.discrete):
+            scores += self.log_probs[:, j, codes[:, a]]
+        if self.continuous:
+            numbers = np.column_stack(
+                [np.array(self.dataset.values[a], np.float64)[codes[:, a]]
+                 for a in self.continuous])
+            scores += self.gaussian_scores(numbers)
+        targetvals = self.values[self.target]
+        return [targetvals[c] for c in np.argmax(scores, axis=0).tolist()]
 
 #______________________________________________________________________________
 
 class NearestNeighborLearner(Learner):
 
-    def __init__(self, k=1):
-        "k-NearestNeighbor: the k nearest neighbors vote."
+    def __init__(self, k=1, metric='hamming', index='auto', leaf_size=16,
+                 tables=10, bits=None):
+        """k-NearestNeighbor: the k nearest neighbors vote.
+        metric is 'hamming' (the fraction of inputs that differ, like
+        mean_boolean_error), 'euclidean' or 'manhattan' (for numeric inputs),
+        or a function giving the distances from each row of a matrix of
+        encoded examples (see encode) to one encoded example.  index is 'kd'
+        for a KDTree, 'ball' for a BallTree, 'lsh' for an (approximate)
+        LSHIndex, None to scan every example, a function (points, metric)
+        returning an index like these, or 'auto': a KDTree when the metric
+        is euclidean or manhattan and every input is numeric, a BallTree for
+        a metric function, and otherwise a scan (hamming distances take so
+        few values that ties keep the trees from pruning much).  leaf_size
+        is passed to a KDTree or BallTree, tables and bits to an LSHIndex.
+        A subclass overriding distance(e1, e2) has that used as the metric
+        instead, on the examples the rows stand for (see ExampleMetric)."""
         self.k = k
+        self.metric = metric
+        self.index = index
+        self.leaf_size = leaf_size
+        self.tables = tables
+        self.bits = bits
+
+    def train(self, dataset):
+        """Encode the training examples as a matrix, one row per example
+        and one column per input, and build the index over it."""
+        self.dataset = dataset
+        self.numeric = [dataset.is_numeric(a) for a in dataset.inputs]
+        self.points = np.column_stack(
+            [dataset.column(a) for a in dataset.inputs]).astype(np.float64)
+        self.classes = dataset.target_codes()
+        ## The metric in use: self.metric, unless distance is overridden
+        self.measure = self.metric
+        if self.__class__.distance.im_func is not \
+           NearestNeighborLearner.distance.im_func:
+            self.measure = ExampleMetric(self)
+        index = self.index
+        if index == 'auto':
+            if self.measure in ('euclidean', 'manhattan') and all(self.numeric):
+                index = 'kd'
+            elif callable(self.measure):
+                index = 'ball'
+            else:
+                index = None
+        if index == 'kd':
+            self.tree = KDTree(self.points, self.measure, self.leaf_size)
+        elif index == 'ball':
+            self.tree = BallTree(self.points, self.measure, self.leaf_size)
+        elif index == 'lsh':
+            self.tree = LSHIndex(self.points, self.measure, self.tables, self.bits)
+        elif callable(index):
+            self.tree = index(self.points, self.measure)
+        else:
+            self.tree = BallTree(self.points, self.measure, len(self.points))
+
+    def encode(self, example):
+        """Return example's inputs as a row of numbers: numeric values as
+        themselves, other values as their codes, or -1 if never seen."""
+        row = np.empty(len(self.numeric))
+        for j, a in enumerate(self.dataset.inputs):
+            if self.numeric[j]:
+                row[j] = example[a]
+            else:
+                row[j] = self.dataset.value_index(a).get(example[a], -1)
+        return row
+
+    def decode(self, row):
+        """Return the example a row of encode's stands for, with None for
+        the attributes that aren't inputs and for codes of -1.  Codes that
+        aren't whole (a BallTree's centers) are rounded."""
+        example = [None] * len(self.dataset.values)
+        for j, a in enumerate(self.dataset.inputs):
+            if self.numeric[j]:
+                example[a] = row[j]
+            elif row[j] >= 0:
+                example[a] = self.dataset.values[a][int(round(row[j]))]
+        return example
 
     def predict(self, example):
         """With k=1, find the point closest to example.
-        With k>1, find k closest, and have them vote for the best."""
-        if self.k == 1:
-            neighbor = argmin(self.dataset.examples,
-                              lambda e: self.distance(e, example))
-            return neighbor[self.dataset.target]
-        else:
-            ## Maintain a sorted list of (distance, example) pairs.
-            ## For very large k, a PriorityQueue would be better
-            best = [] 
-            for e in self.dataset.examples:
-                d = self.distance(e, example)
-                if len(best) < self.k: 
-                    best.append((d, e))
-                elif d < best[-1][0]:
-                    best[-1] = (d, e)
-                    best.sort()
-            return mode([e[self.dataset.target] for (d, e) in best])
+        With k>1, find k closest, and have them vote for the best.
+        The index prunes the parts of the training set that can't hold
+        anything closer than the k best found so far; ties go to the
+        example that comes first."""
+        nearest = self.tree.search(self.encode(example), self.k)
+        classes = self.classes[[i for (d, i) in nearest]]
+        targetvals = self.dataset.values[self.dataset.target]
+        return targetvals[vote(classes[None, :], len(targetvals))[0]]
+
+    def encode_codes(self, codes):
+        """Encode each row of a code matrix (in the dictionary of the
+        dataset trained on) like encode."""
+        points = np.empty((len(codes), len(self.numeric)))
+        for j, a in enumerate(self.dataset.inputs):
+            if self.numeric[j]:
+                table = np.array(self.dataset.values[a], np.float64)
+                points[:, j] = table[codes[:, a]]
+            else:
+                points[:, j] = codes[:, a]
+        return points
+
+    tile = 2**20  # the most query x training distances to hold at once
+
+    def predict_batch(self, codes):
+        """Predict the target value of each row of a code matrix, scanning
+        the training set for a tile of queries at a time: compute the block
+        of their distances to every training example, then pick out each
+        query's k nearest by partial selection rather than sorting.  The
+        neighbors (ties included) are the ones predict would find.  An
+        approximate index is searched one query at a time instead."""
+        queries = self.encode_codes(codes)
+        targetvals = self.dataset.values[self.dataset.target]
+        if not self.tree.exact:
+            nearest = [[i for (d, i) in self.tree.search(q, self.k)]
+                       for q in queries]
+            votes = vote(self.classes[np.array(nearest, int)], len(targetvals))
+            return [targetvals[c] for c in votes.tolist()]
+        rows = max(1, self.tile // max(len(self.points), 1))
+        encoded = None
+        if self.measure == 'hamming':
+            encoded = one_hot(self.points, self.points)
+        classes = [self.classes[self.nearest(queries[i:i+rows], encoded)]
+                   for i in range(0, len(queries), rows)]
+        votes = vote(np.concatenate(classes), len(targetvals))
+        return [targetvals[c] for c in votes.tolist()]
+
+    def nearest(self, queries, encoded=None):
+        """Return the rows of the k training points nearest to each of the
+        queries, nearest first, equally distant ones in row order.  For
+        hamming, encoded may give one_hot(self.points, self.points)."""
+        D = distance_block(self.points, queries, self.measure, encoded)
+        k = min(self.k, len(self.points))
+        kth = np.partition(D, k - 1, axis=1)[:, k - 1:k]
+        ## Everything nearer than the kth distance, then the first few at it
+        at_kth = D == kth
+        chosen = (D < kth) | at_kth & \
+                 (np.cumsum(at_kth, axis=1) <= k - (D < kth).sum(axis=1)[:, None])
+        rows = np.nonzero(chosen)[1].reshape(len(queries), k)
+        order = np.argsort(D[np.arange(len(queries))[:, None], rows],
+                           axis=1, kind='mergesort')
+        return rows[np.arange(len(queries))[:, None], order]
 
     def distance(self, e1, e2):
+        """The distance between two examples, for subclasses to override;
+        this one, like the hamming metric, is the fraction that differ."""
         return mean_boolean_error(e1, e2)
 
+class ExampleMetric:
+    """A metric function (see NearestNeighborLearner) that decodes each
+    row back into an example and calls the learner's distance method on
+    them, one pair at a time."""
+
+    def __init__(self, learner):
+        self.learner = learner
+
+    def __call__(self, points, q):
+        distance, decode = self.learner.distance, self.learner.decode
+        example = decode(q)
+        return np.array([distance(decode(p), example) for p in points], np.float64)
+
+def vote(classes, nclasses):
+    """Given the target codes of each example's neighbors (one row each,
+    nearest first), return the most common code in each row; a tie goes
+    to the class of the nearest of the tied neighbors."""
+    rows = np.arange(len(classes))[:, None]
+    counts = np.zeros((len(classes), nclasses), np.int32)
+    for j in range(classes.shape[1]):
+        counts[rows[:, 0], classes[:, j]] += 1
+    winners = counts[rows, classes] == counts.max(axis=1)[:, None]
+    return classes[rows[:, 0], winners.argmax(axis=1)]
+
+def hamming_distances(points, q):
+    "The fraction of the columns of each row of points that differ from q."
+    return (points != q).mean(axis=1)
+
+def euclidean_distances(points, q):
+    return np.sqrt(((points - q)**2).sum(axis=1))
+
+def manhattan_distances(points, q):
+    return abs(points - q).sum(axis=1)
+
+metrics = {'hamming': hamming_distances, 'euclidean': euclidean_distances,
+           'manhattan': manhattan_distances}
+
+def distance_block(points, queries, metric, encoded=None):
+    """Return the matrix of distances from each of the queries (rows) to
+    each of the points (columns), for a metric named in metrics or a
+    function as for NearestNeighborLearner.  Euclidean and manhattan
+    distances are summed one column at a time, so only blocks of that
+    shape are ever held; hamming distances count the matching values as
+    a product of one-hot matrices.  A caller scoring many blocks against
+    the same points can pass encoded = one_hot(points, points) to save
+    rebuilding it each time."""
+    if metric not in metrics:
+        return np.array([metric(points, q) for q in queries]).reshape(
+            len(queries), len(points))
+    if metric == 'hamming':
+        width = points.shape[1]
+        if encoded is None:
+            encoded = one_hot(points, points)
+        matches = np.dot(one_hot(queries, points), encoded.T)
+        return (width - matches.astype(np.float64)) / max(width, 1)
+    D = np.zeros((len(queries), len(points)))
+    for j in range(points.shape[1]):
+        diff = queries[:, j, None] - points[None, :, j]
+        if metric == 'euclidean':
+            D += diff**2
+        else:
+            D += abs(diff)
+    if metric == 'euclidean':
+        np.sqrt(D, D)
+    return D
+
+def one_hot(rows, points):
+    """Return a 0/1 matrix with a row for each of rows and a column for
+    each distinct value in each column of points, marking which value the
+    row has in each column (none, if it's not among them)."""
+    blocks = []
+    for j in range(points.shape[1]):
+        vals = np.unique(points[:, j])
+        where = np.minimum(np.searchsorted(vals, rows[:, j]), len(vals) - 1)
+        blocks.append((vals[where] == rows[:, j])[:, None] &
+                      (where[:, None] == np.arange(len(vals))))
+    return np.hstack(blocks).astype(np.float32)  # counts up to 2**24 are exact
+
+class SpatialIndex(object):
+    """A tree over the rows of a matrix of points, for finding the nearest
+    ones to a query by branch and bound.  Node i holds the points at
+    self.order[self.start[i]:self.end[i]] and has self.children[i] (none
+    for a leaf).  Subclasses build the tree and give bound(i, q): a lower
+    bound on the distance from q to any point of node i."""
+
+    exact = True  # search always finds the true nearest points
+
+    def __init__(self, points, metric='euclidean', leaf_size=16):
+        self.points = points
+        self.distances = metrics.get(metric, metric)
+        self.leaf_size = max(leaf_size, 1)
+        self.order = np.arange(len(points))
+        self.start, self.end, self.children = [], [], []
+        if len(points):
+            self.build(0, len(points))
+
+    def add_node(self, start, end):
+        "Add a node (a leaf, until given children) and return its number."
+        self.start.append(start)
+        self.end.append(end)
+        self.children.append(())
+        return len(self.start) - 1
+
+    def split(self, start, end, keys):
+        """Reorder self.order[start:end] so the points with the smaller
+        half of keys come first, and return the middle position."""
+        mid = (start + end) // 2
+        part = np.argpartition(keys, mid - start, kind='introselect')
+        self.order[start:end] = self.order[start:end][part]
+        return mid
+
+    def search(self, q, k=1):
+        """Return (distance, i) for the k points nearest to q, nearest first,
+        i being the point's row in self.points.  Equally distant points are
+        taken in row order."""
+        heap = []  # (-distance, -i) of the k best so far; the worst on top
+        def visit(node):
+            if not self.children[node]:
+                rows = self.order[self.start[node]:self.end[node]]
+                for d, i in zip(self.distances(self.points[rows], q).tolist(),
+                                rows.tolist()):
+                    if len(heap) < k:
+                        heapq.heappush(heap, (-d, -i))
+                    elif (-d, -i) > heap[0]:
+                        heapq.heapreplace(heap, (-d, -i))
+                return
+            bounds = [(self.bound(child, q), child)
+                      for child in self.children[node]]
+            for bound, child in sorted(bounds):
+                if len(heap) == k and bound > -heap[0][0]:
+                    break
+                visit(child)
+        if len(self.start):
+            visit(0)
+        return sorted([(-d, -i) for (d, i) in heap])
+
+class KDTree(SpatialIndex):
+    """Split each node at the median of its widest coordinate, and bound
+    the distance to a node by the distance to its bounding box.  That
+    bound holds for the hamming, euclidean and manhattan metrics."""
+
+    def build(self, start, end):
+        node = self.add_node(start, end)
+        points = self.points[self.order[start:end]]
+        self.lo.append(points.min(axis=0))
+        self.hi.append(points.max(axis=0))
+        widths = self.hi[node] - self.lo[node]
+        if end - start > self.leaf_size and widths.max() > 0:
+            mid = self.split(start, end, points[:, widths.argmax()])
+            self.children[node] = (self.build(start, mid),
+                                   self.build(mid, end))
+        return node
+
+    def __init__(self, points, metric='euclidean', leaf_size=16):
+        if metric not in metrics:
+            raise ValueError('A KDTree needs one of the metrics %s' % metrics.keys())
+        self.lo, self.hi = [], []
+        SpatialIndex.__init__(self, points, metric, leaf_size)
+
+    def bound(self, node, q):
+        gaps = np.maximum(self.lo[node] - q, 0) + np.maximum(q - self.hi[node], 0)
+        if self.distances is hamming_distances:
+            return float((gaps > 0).mean())
+        return float(self.distances(gaps[None, :], 0)[0])
+
+class BallTree(SpatialIndex):
+    """Enclose each node's points in a ball around their coordinatewise
+    median, and split them between the two points farthest apart (roughly)
+    by which one each is nearer.  The bound, the distance to the center
+    less the radius, holds for any metric obeying the triangle inequality."""
+
+    def __init__(self, points, metric='euclidean', leaf_size=16):
+        self.centers, self.radii = [], []
+        SpatialIndex.__init__(self, points, metric, leaf_size)
+
+    def build(self, start, end):
+        node = self.add_node(start, end)
+        points = self.points[self.order[start:end]]
+        self.centers.append(np.median(points, axis=0))
+        self.radii.append(self.distances(points, self.centers[node]).max())
+        if end - start > self.leaf_size and self.radii[node] > 0:
+            a = points[self.distances(points, points[0]).argmax()]
+            b = points[self.distances(points, a).argmax()]
+            keys = self.distances(points, a) - self.distances(points, b)
+            mid = self.split(start, end, keys)
+            self.children[node] = (self.build(start, mid),
+                                   self.build(mid, end))
+        return node
+
+    def bound(self, node, q):
+        ## Less a little, so rounding can't lift it above a tied distance
+        d = float(self.distances(self.centers[node][None, :], q)[0])
+        return max(d - self.radii[node] - 1e-9 * (d + self.radii[node]), 0.0)
+
+class LSHIndex(object):
+    """Bit-sampling locality-sensitive hashing, for the hamming metric on
+    rows of codes.  Each of several tables hashes the points by their whole
+    values in a random sample of the columns (a column's code playing the
+    part of a bit), so points differing in few columns are likely to share
+    a bucket in at least one table.  search ranks just the points sharing a
+    bucket with the query, exactly.  More tables find more of the true
+    neighbors, at the cost of more candidates; more bits (columns sampled)
+    per table make the buckets, and so the candidates, fewer.  bits
+    defaults to a third of the columns."""
+
+    exact = False
+
+    def __init__(self, points, metric='hamming', tables=10, bits=None):
+        if metric != 'hamming':
+            raise ValueError('An LSHIndex only supports the hamming metric')
+        self.points = points
+        columns = range(points.shape[1])
+        self.bits = min(bits or max(1, len(columns) // 3), len(columns))
+        self.samples = [sorted(random.sample(columns, self.bits))
+                        for t in range(tables)]
+        self.buckets = []
+        for sample in self.samples:
+            buckets = {}
+            for i, key in enumerate(map(tuple, points[:, sample].tolist())):
+                buckets.setdefault(key, []).append(i)
+            self.buckets.append(dict([(key, np.array(rows))
+                                      for (key, rows) in buckets.items()]))
+
+    def candidates(self, q):
+        "Return the rows of the points sharing a bucket with q in any table."
+        found = [buckets.get(tuple(q[sample].tolist()))
+                 for sample, buckets in zip(self.samples, self.buckets)]
+        found = [rows for rows in found if rows is not None]
+        if not found:
+            return np.zeros(0, int)
+        return np.unique(np.concatenate(found))
+
+    def search(self, q, k=1):
+        """Return (distance, i) for the k candidates nearest to q, nearest
+        first, as SpatialIndex.search does.  If there are fewer than k
+        candidates, scan all the points."""
+        rows = self.candidates(q)
+        if len(rows) < k:
+            rows = np.arange(len(self.points))
+        distances = hamming_distances(self.points[rows], q)
+        return sorted(zip(distances.tolist(), rows.tolist()))[:k]
+
 #______________________________________________________________________________
 
 class EnsembleLearner(Learner):
     """Given a list of learning algorithms, have them vote."""
 
-    def __init__(self, learners=[]):
-        self.learners=learners
+    def __init__(self, learners=[], weights=None, processes=1):
+        """weights, if given, says how much each learner's vote counts.
+        With processes other than 1 the learners are trained, and batches
+        of examples predicted, in a pool of processes (see pool_map)."""
+        self.learners = learners
+        self.weights = weights
+        self.processes = processes
 
     def train(self, dataset):
+        """Train every learner on dataset.  Learners trained in a pool
+        come back as copies, which replace the originals in self.learners."""
+        self.dataset = dataset
+        self.learners = pool_map(train_member, range(len(self.learners)),
+                                 self.processes, learners=self.learners,
+                                 dataset=dataset)
         for learner in self.learners:
-           learner.train(dataset)
+            learner.dataset = dataset
 
     def predict(self, example):
-        return mode([learner.predict(example) for learner in self.learners])
+        return self.vote([[learner.predict(example)] for learner in self.learners])[0]
+
+    def predict_batch(self, codes):
+        """Predict the target value of each row of a code matrix: have each
+        learner predict the whole batch, and count all the votes at once."""
+        return self.vote(pool_map(predict_member, range(len(self.learners)),
+                                  self.processes, learners=self.learners,
+                                  codes=codes))
+
+    def vote(self, predictions):
+        """Given each learner's list of predictions, return the value with
+        the most (weighted) votes for each example; ties go to the value
+        that comes first in the dataset."""
+        targetvals = self.dataset.values[self.dataset.target] + [None]
+        index = self.dataset.value_index(self.dataset.target)
+        weights = self.weights or [1] * len(self.learners)
+        votes = np.array([[index.get(p, len(targetvals) - 1) for p in column]
+                          for column in predictions], np.int32)
+        scores = np.zeros((votes.shape[1], len(targetvals)))
+        rows = np.arange(votes.shape[1])
+        for learner_votes, weight in zip(votes, weights):
+            scores[rows, learner_votes] += weight
+        return [targetvals[c] for c in scores.argmax(axis=1).tolist()]
+
+def train_member(i):
+    "Train the i'th learner of an EnsembleLearner, for pool_map."
+    learner = shared['learners'][i]
+    learner.train(shared['dataset'])
+    return pool_result(learner)
+
+def predict_member(i):
+    """Predict the batch of codes with the i'th learner of an EnsembleLearner,
+    for pool_map; learners without predict_batch predict row by row."""
+    learner, codes = shared['learners'][i], shared['codes']
+    if hasattr(learner, 'predict_batch'):
+        return list(learner.predict_batch(codes))
+    return map(learner.predict, learner.dataset.examples.decode(codes))
+
+#______________________________________________________________________________
+
+class RandomForestLearner(Learner):
+    """Grow decision trees on bootstrap samples of the examples, each tree
+    choosing every split from a random few of the attributes, and have
+    them vote.  Only the trees' CompiledTree arrays are kept."""
+
+    def __init__(self, trees=10, max_features=None, numeric_splits=True,
+                 processes=1, seed=None):
+        """max_features is how many attributes each split is chosen from;
+        by default the square root of the number of inputs.  The trees are
+        grown in a pool of processes (see pool_map), each reseeding random
+        from (seed, tree), so the forest doesn't depend on how many
+        processes there were."""
+        self.trees = trees
+        self.max_features = max_features
+        self.numeric_splits = numeric_splits
+        self.processes = processes
+        self.seed = seed
+
+    def train(self, dataset):
+        """Grow the forest.  As a side effect, estimate its accuracy out of
+        bag: self.oob_accuracy is the accuracy of the vote of just the trees
+        whose sample left each example out, over the examples that at least
+        one tree left out (None if there are none)."""
+        self.dataset = dataset
+        seed = self.seed
+        if seed is None:
+            seed = random.getrandbits(32)
+        max_features = self.max_features or \
+                       max(1, int(round(math.sqrt(len(dataset.inputs)))))
+        state = random.getstate()
+        try:
+            grown = pool_map(grow_tree, range(self.trees), self.processes,
+                             dataset=dataset, seed=seed, max_features=max_features,
+                             numeric_splits=self.numeric_splits)
+        finally:
+            random.setstate(state)
+        self.forest = [compiled for (compiled, oob, predicted) in grown]
+        votes = np.zeros((len(dataset.examples),
+                          len(dataset.values[dataset.target]) + 1))
+        for compiled, oob, predicted in grown:
+            votes[oob, predicted] += 1
+        voted = votes.sum(axis=1) > 0
+        if voted.any():
+            right = votes[voted].argmax(axis=1) == dataset.target_codes()[voted]
+            self.oob_accuracy = right.mean()
+        else:
+            self.oob_accuracy = None
+
+    def predict(self, example):
+        """Predict the target value for example.  Numbers the dataset lacks
+        are compared with the trees' thresholds; other values it lacks
+        raise KeyError if a tree branches on them."""
+        codes, numbers = query_matrices(self.dataset, [example])
+        return vote_trees(self.forest, None, self.dataset, codes, numbers)[0]
+
+    def predict_batch(self, codes):
+        """Predict the target value of each row of a code matrix, routing
+        it through every tree; ties go to the value listed first."""
+        return vote_trees(self.forest, None, self.dataset, codes)
+
+def grow_tree(t):
+    """Grow tree number t of a RandomForestLearner, for pool_map, on a
+    bootstrap sample of the dataset: a view whose order draws n of its n
+    examples with replacement.  Return the compacted CompiledTree, the
+    examples left out of the sample, and the target codes it predicts for
+    them (-1 for None)."""
+    random.seed(hash((shared['seed'], t)))
+    dataset = shared['dataset']
+    n = len(dataset.examples)
+    sample = np.random.RandomState(random.getrandbits(32)).randint(0, n, n)
+    learner = DecisionTreeLearner(shared['numeric_splits'], shared['max_features'])
+    learner.train(DataSetView(dataset, sample))
+    compiled = learner.compiled().compact()
+    oob = np.setdiff1d(np.arange(n), sample)
+    codes = dataset.code_matrix()[oob]
+    numbers = numeric_matrix(dataset.values, codes, compiled.split_attrs)
+    return compiled, oob, compiled.predict_codes(codes, numbers)
+
+#______________________________________________________________________________
+
+class AdaBoostLearner(Learner):
+    """Boosting by SAMME, the multi-class AdaBoost of Zhu et al.: grow a
+    series of small decision trees, each on the examples reweighted
+    towards the ones its predecessors got wrong, and have them vote, each
+    tree's vote weighted by how well it did."""
+
+    def __init__(self, rounds=50, max_depth=1, numeric_splits=True):
+        """Grow up to rounds trees of at most max_depth tests (stumps, by
+        default).  Boosting stops early if a tree is perfect, or no better
+        than guessing."""
+        self.rounds = rounds
+        self.max_depth = max_depth
+        self.numeric_splits = numeric_splits
+
+    def train(self, dataset):
+        """Every round regrows one DecisionTreeLearner with new weights, so
+        the columns are encoded and presorted just once.  self.stages holds
+        the compacted CompiledTree of each round, self.alphas its say."""
+        self.dataset = dataset
+        tree = DecisionTreeLearner(self.numeric_splits, max_depth=self.max_depth)
+        tree.prepare(dataset)
+        codes, classes = dataset.code_matrix(), dataset.target_codes()
+        numbers = numeric_matrix(dataset.values, codes,
+                                 filter(dataset.is_numeric, dataset.inputs))
+        nclasses = len(dataset.values[dataset.target])
+        weights = np.ones(len(classes)) / max(len(classes), 1)
+        self.stages, self.alphas = [], []
+        for round in range(self.rounds):
+            tree.grow(weights)
+            compiled = CompiledTree(tree.dt, dataset).compact()
+            wrong = compiled.predict_codes(codes, numbers) != classes
+            error = weights[wrong].sum() / weights.sum()
+            if error >= 1 - 1.0 / nclasses:
+                break
+            self.stages.append(compiled)
+            if error <= 0:
+                self.alphas.append(1.0)
+                break
+            alpha = math.log((1 - error) / error) + math.log(nclasses - 1)
+            self.alphas.append(alpha)
+            weights = weights * np.exp(alpha * wrong)
+            weights /= weights.sum()
+        if not self.stages:
+            ## Not even the first tree beat guessing (or there were no
+            ## rounds): keep an unweighted tree anyway
+            tree.grow(np.ones(len(classes)))
+            self.stages = [CompiledTree(tree.dt, dataset).compact()]
+            self.alphas = [1.0]
+
+    def predict(self, example):
+        """Predict the target value for example.  Numbers the dataset lacks
+        are compared with the trees' thresholds; other values it lacks
+        raise KeyError if a tree branches on them."""
+        codes, numbers = query_matrices(self.dataset, [example])
+        return vote_trees(self.stages, self.alphas, self.dataset, codes, numbers)[0]
+
+    def predict_batch(self, codes):
+        """Predict the target value of each row of a code matrix by the
+        weighted vote of the trees; ties go to the value listed first."""
+        return vote_trees(self.stages, self.alphas, self.dataset, codes)
 
 #______________________________________________________________________________
     
 class DecisionTree:
     """A DecisionTree holds an attribute that is being tested, and a
     dict of {attrval: Tree} entries.  If Tree here is not a DecisionTree
-    then it is the final classification of the example."""
-
-    def __init__(self, attr, attrname=None, branches=None):
+    then it is the final classification of the example.  If the node has a
+    threshold, it tests a numeric attribute against it instead, and the
+    dict is {True: Tree, False: Tree} for attr <= threshold or not.  A
+    learned tree also records the majority target value of the training
+    examples that reached it (for use in pruning)."""
+
+    def __init__(self, attr, attrname=None, branches=None, threshold=None,
+                 majority=None):
         "Initialize by saying what attribute this node tests."
         update(self, attr=attr, attrname=attrname or attr,
-               branches=branches or {})
+               branches=branches or {}, threshold=threshold,
+               majority=majority)
+
+    def branch_value(self, example):
+        "Return the key of the branch that example goes down."
+        if self.threshold is None:
+            return example[self.attr]
+        return example[self.attr] <= self.threshold
 
     def predict(self, example):
         "Given an example, use the tree to classify the example."
-        child = self.branches[example[self.attr]]
+        child = self.branches[self.branch_value(example)]
         if isinstance(child, DecisionTree):
             return child.predict(example)
         else:
@@ -154,7 +873,10 @@ class DecisionTree:
         name = self.attrname
         print 'Test', name
         for (val, subtree) in self.branches.items():
-            print ' '*4*indent, name, '=', val, '==>',
+            if self.threshold is None:
+                print ' '*4*indent, name, '=', val, '==>',
+            else:
+                print ' '*4*indent, name, val and '<=' or '>', self.threshold, '==>',
             if isinstance(subtree, DecisionTree):
                 subtree.display(indent+1)
             else:
@@ -195,16 +917,189 @@ class DecisionTree:
             new_branches = {}
             for val, subtree in self.branches.items():
                 if isinstance(subtree, DecisionTree):
-                    sub_values = filter_by(self.attr, val, values)
+                    sub_values = [e for e in values if self.branch_value(e) == val]
                     new_branches[val] = subtree.copy(exclude, sub_values, target)
                 else:
                     new_branches[val] = subtree
-            return DecisionTree(self.attr, self.attrname, new_branches)
+            return DecisionTree(self.attr, self.attrname, new_branches,
+                                self.threshold, self.majority)
 
     def __repr__(self):
+        if self.threshold is not None:
+            return 'DecisionTree(%r, %r, %r, %r)' % (
+                self.attr, self.attrname, self.branches, self.threshold)
         return 'DecisionTree(%r, %r, %r)' % (
             self.attr, self.attrname, self.branches)
 
+class CompiledTree:
+    """A DecisionTree (or a lone leaf value) flattened into parallel arrays,
+    so that a whole code matrix can be routed through it at once.  Node 0
+    is the root.  For node i:
+
+    feature[i]    The attribute the node tests, or -1 for a leaf.
+    threshold[i]  The node's threshold, or nan if it branches on values.
+    offset[i]     Where the node's children start in children.  An example
+                  whose code for feature[i] is c goes on to node
+                  children[offset[i] + c]; at a threshold node, one whose
+                  value is at most the threshold goes on to node
+                  children[offset[i]], any other to children[offset[i] + 1].
+    size[i]       The node's number of children (0 for a leaf).
+    leaf[i]       For a leaf, the code of its target value (-1 for None).
+    nodes[i]      The DecisionTree (or leaf value) the node was compiled from.
+
+    Every node is numbered after its parent.  split_attrs lists the
+    attributes tested at thresholds."""
+
+    def __init__(self, tree, dataset):
+        self.tree = tree
+        self.values = values = dataset.values
+        targetvals = values[dataset.target]
+        self.targets = np.empty(len(targetvals) + 1, object)
+        self.targets[:-1] = targetvals
+        self.targets[-1] = None
+        target_index = dataset.value_index(dataset.target)
+        feature, threshold, offset, children, leaf = [], [], [], [], []
+        size = []
+        self.nodes = []
+        def add(node):
+            i = len(feature)
+            self.nodes.append(node)
+            feature.append(-1)
+            threshold.append(np.nan)
+            offset.append(0)
+            size.append(0)
+            leaf.append(-1)
+            if not isinstance(node, DecisionTree):
+                leaf[i] = target_index.get(node, -1)
+                return i
+            feature[i] = node.attr
+            if node.threshold is not None:
+                threshold[i] = node.threshold
+            if node.threshold is None:
+                keys = values[node.attr]
+            else:
+                keys = [True, False]
+            start = offset[i] = len(children)
+            size[i] = len(keys)
+            children.extend([-1] * size[i])
+            compiled = {}
+            for c, key in enumerate(keys):
+                if key not in compiled:
+                    compiled[key] = add(node.branches[key])
+                children[start + c] = compiled[key]
+            return i
+        add(tree)
+        self.feature = np.array(feature, np.int32)
+        self.threshold = np.array(threshold, np.float64)
+        self.offset = np.array(offset, np.int32)
+        self.size = np.array(size, np.int32)
+        self.children = np.array(children, np.int32)
+        self.leaf = np.array(leaf, np.int32)
+        self.split_attrs = sorted(set(self.feature[~np.isnan(self.threshold)].tolist()))
+
+    def branches(self, i):
+        "Return the distinct children of internal node i."
+        start = self.offset[i]
+        return np.unique(self.children[start:start + self.size[i]])
+
+    def route(self, codes, numbers=None, visit=None):
+        """Return the leaf reached by each row of a code matrix.  Threshold
+        nodes compare the rows' values in numbers, a float matrix shaped
+        like codes (see numeric_matrix; by default it is looked up from the
+        codes), so values the dataset lacks find their way too.  A code of
+        -1 (or a number of nan) stands for a value the dataset lacks;
+        reaching a node that has no branch for it raises KeyError, as
+        DecisionTree.predict does.  All rows move down one level of the
+        tree per step; if visit is given, it is called with the rows still
+        moving and the nodes they are at."""
+        if numbers is None:
+            numbers = numeric_matrix(self.values, codes, self.split_attrs)
+        node = np.zeros(len(codes), np.int32)
+        active = np.arange(len(codes))
+        while len(active):
+            current = node[active]
+            if visit: visit(active, current)
+            internal = self.feature[current] >= 0
+            active, current = active[internal], current[internal]
+            feature = self.feature[current]
+            branch = codes[active, feature]
+            threshold = self.threshold[current]
+            split = ~np.isnan(threshold)
+            if split.any():
+                number = numbers[active[split], feature[split]]
+                branch[split] = np.where(np.isnan(number), -1,
+                                         number > threshold[split])
+            if (branch < 0).any():
+                raise KeyError("no branch for a value of attribute %d" %
+                               feature[branch < 0][0])
+            node[active] = self.children[self.offset[current] + branch]
+        return node
+
+    def node_counts(self, codes, classes, numbers=None):
+        """Route the rows of a code matrix through the tree, and return a
+        table: counts[i][c] is the number of rows with target code c
+        (classes[row]) that reached node i.  The last column counts the
+        rows whose target value the dataset lacks (code -1)."""
+        nclasses = len(self.targets)
+        classes = np.where(classes < 0, nclasses - 1, classes)
+        counts = np.zeros(len(self.feature) * nclasses, np.int64)
+        def visit(rows, nodes):
+            counts[:] += np.bincount(nodes * nclasses + classes[rows],
+                                     minlength=len(counts))
+        self.route(codes, numbers, visit)
+        return counts.reshape(len(self.feature), nclasses)
+
+    def predict_codes(self, codes, numbers=None):
+        """Return the target code (-1 for None) predicted for each row of a
+        code matrix."""
+        return self.leaf[self.route(codes, numbers)]
+
+    def predict_batch(self, codes, numbers=None):
+        "Return the target value predicted for each row of a code matrix."
+        return list(self.targets[self.predict_codes(codes, numbers)])
+
+    def compact(self):
+        """Drop the DecisionTree the arrays were compiled from, which only
+        pruning needs, and the dataset's values, and return self.  A
+        compacted tree must be given the numbers matrix to route with."""
+        self.tree, self.nodes, self.values = None, None, None
+        return self
+
+def numeric_matrix(values, codes, attrs):
+    """Return a float matrix shaped like codes whose columns attrs hold the
+    numbers the codes stand for (in values); the other columns are 0."""
+    numbers = np.zeros(codes.shape)
+    for a in attrs:
+        numbers[:, a] = np.array(values[a], np.float64)[codes[:, a]]
+    return numbers
+
+def query_matrices(dataset, examples):
+    """Return the code matrix of a list of examples (lists of values), and
+    the numbers matrix to route it with (see CompiledTree.route).  Values
+    dataset lacks get code -1; values that aren't numbers get nan."""
+    codes = np.array([[dataset.value_index(a).get(v, -1)
+                       for (a, v) in enumerate(example)]
+                      for example in examples], np.int32)
+    numbers = np.array([[float(v) if isnumber(v) else np.nan
+                         for v in example] for example in examples], np.float64)
+    return codes.reshape(len(examples), -1), numbers.reshape(codes.shape)
+
+def vote_trees(trees, weights, dataset, codes, numbers=None):
+    """Return the target value with the most votes of the CompiledTrees for
+    each row of a code matrix, a tree's vote counting its weight (or 1 if
+    weights is None); ties go to the value listed first."""
+    targetvals = dataset.values[dataset.target] + [None]
+    if numbers is None:
+        attrs = set()
+        for tree in trees:
+            attrs.update(tree.split_attrs)
+        numbers = numeric_matrix(dataset.values, codes, sorted(attrs))
+    votes = np.zeros((len(codes), len(targetvals)))
+    rows = np.arange(len(codes))
+    for tree, weight in zip(trees, weights or [1] * len(trees)):
+        votes[rows, tree.predict_codes(codes, numbers)] += weight
+    return [targetvals[c] for c in votes.argmax(axis=1).tolist()]
+
 def filter_by(attr_number, attr_value, values):
     def has_attr_value(example):
         return example[attr_number] == attr_value
@@ -215,6 +1110,20 @@ Yes, No = True, False
 #______________________________________________________________________________
 
 class DecisionTreeLearner(Learner):
+    """With numeric_splits, numeric attributes are split in two at the
+    threshold with the highest information gain (and may be split again
+    further down), rather than branching on every distinct value.  With
+    max_features, each split is chosen from that many of the remaining
+    attributes, picked at random (see RandomForestLearner).  With
+    max_depth, no path has more than that many tests (1 gives stumps)."""
+
+    transient = Learner.transient + ('columns', 'classes', 'numeric',
+                                     'presorted', 'sorted', 'index', 'weights')
+
+    def __init__(self, numeric_splits=True, max_features=None, max_depth=None):
+        self.numeric_splits = numeric_splits
+        self.max_features = max_features
+        self.max_depth = max_depth
 
     def predict(self, example):
         if isinstance(self.dt, DecisionTree):
@@ -222,30 +1131,173 @@ class DecisionTreeLearner(Learner):
         else:
             return self.dt
 
-    def train(self, dataset):
+    def predict_batch(self, codes):
+        """Predict the target value of each row of a code matrix (in the
+        dictionary of self.dataset.values), routing them all through the
+        compiled tree at once."""
+        return self.compiled().predict_batch(codes)
+
+    def compiled(self):
+        "Return the CompiledTree for self.dt, compiling it if need be."
+        if getattr(self, '_compiled', None) is None or \
+           self._compiled.tree is not self.dt:
+            self._compiled = CompiledTree(self.dt, self.dataset)
+        return self._compiled
+
+    def train(self, dataset, weights=None):
+        """Grow the tree from the dataset's code matrix.  The examples at
+        each node are the slice [lo:hi] of self.index, an array of example
+        indices which is partitioned in place as the tree grows, so no lists
+        of examples are built along the way.  Each numeric attribute also
+        has an array of indices, sorted by its values once at the start and
+        partitioned alongside self.index, so the node's examples in
+        self.sorted[attr][lo:hi] are always in order.  If weights (one per
+        example) are given, examples count for that much in every split."""
+        self.prepare(dataset)
+        self.grow(weights)
+
+    def prepare(self, dataset):
+        """Set up the columns, and the presorted indices of the numeric
+        attributes, that grow builds trees from."""
         self.dataset = dataset
         self.attrnames = dataset.attrnames
-        self.dt = self.decision_tree_learning(dataset.examples, dataset.inputs)
-
-    def decision_tree_learning(self, examples, attrs, default=None):
-        if len(examples) == 0:
+        codes = dataset.code_matrix()
+        self.columns = [codes[:, a] for a in range(codes.shape[1])]
+        self.classes = dataset.target_codes()
+        self.numeric = {}
+        if self.numeric_splits:
+            for a in dataset.inputs:
+                if dataset.is_numeric(a):
+                    self.numeric[a] = dataset.column(a)
+        self.presorted = dict((a, column.argsort(kind='mergesort'))
+                              for (a, column) in self.numeric.items())
+
+    def grow(self, weights=None):
+        """Grow self.dt from the prepared dataset, weighting the examples
+        by weights if given.  Growing again (say, with new weights) reuses
+        the columns and the presorted indices."""
+        self.weights = weights
+        if weights is not None:
+            self.weights = np.asarray(weights, np.float64)
+        self.sorted = dict((a, order.copy())
+                           for (a, order) in self.presorted.items())
+        self.index = np.arange(len(self.classes))
+        self.dt = self.decision_tree_learning(0, len(self.index),
+                                              self.dataset.inputs)
+
+    def decision_tree_learning(self, lo, hi, attrs, default=None, depth=0):
+        """Return a tree (or a leaf value) for the examples in
+        self.index[lo:hi], depth tests below the root.  The index arrays
+        are reordered in place, so that each branch's examples are a
+        contiguous slice of them."""
+        if hi == lo:
             return default
-        elif self.all_same_class(examples):
-            return examples[0][self.dataset.target]
-        elif  len(attrs) == 0:
-            return self.majority_value(examples)
+        targetvals = self.dataset.values[self.dataset.target]
+        counts = self.class_counts(self.index[lo:hi])
+        majority = targetvals[counts.argmax()]
+        if (counts > 0).sum() == 1:
+            return majority
+        elif  len(attrs) == 0 or depth == self.max_depth:
+            return majority
+        best, threshold = self.choose_attribute(attrs, lo, hi)
+        if best is None:
+            return majority
+        if threshold is None:
+            tree = DecisionTree(best, self.attrnames[best], majority=majority)
+            keys = self.dataset.values[best]
+            branch = lambda index: self.columns[best][index]
+            attrs = removeall(best, attrs)
         else:
-            best = self.choose_attribute(attrs, examples)
-            tree = DecisionTree(best, self.attrnames[best])
-            for (v, examples_i) in self.split_by(best, examples):
-                subtree = self.decision_tree_learning(examples_i,
-                  removeall(best, attrs), self.majority_value(examples))
-                tree.add(v, subtree)
-            return tree
-
-    def choose_attribute(self, attrs, examples):
-        "Choose the attribute with the highest information gain."
-        return argmax(attrs, lambda a: self.information_gain(a, examples))
+            tree = DecisionTree(best, self.attrnames[best], threshold=threshold,
+                                majority=majority)
+            keys = [True, False]
+            branch = lambda index: \
+                (self.numeric[best][index] > threshold).astype(np.int32)
+        sizes = np.bincount(branch(self.index[lo:hi]), minlength=len(keys))
+        for index in [self.index] + self.sorted.values():
+            segment = index[lo:hi]
+            segment[:] = segment[branch(segment).argsort(kind='mergesort')]
+        start = lo
+        for v, size in zip(keys, sizes):
+            subtree = self.decision_tree_learning(start, start+size,
+              attrs, majority, depth + 1)
+            tree.add(v, subtree)
+            start += size
+        return tree
+
+    def choose_attribute(self, attrs, lo, hi):
+        """Choose the attribute with the highest information gain for the
+        examples in self.index[lo:hi].  Return it and, if it is to be split
+        at a threshold, the threshold (else None).  Return (None, None) if
+        no attribute can split the examples.  With max_features, only that
+        many attributes, drawn at random, are considered; if none of them
+        can split the examples, as many more are drawn from the rest."""
+        step = len(attrs)
+        if self.max_features and len(attrs) > self.max_features:
+            attrs, step = random.sample(attrs, len(attrs)), self.max_features
+        index = self.index[lo:hi]
+        splits = {}
+        for start in range(0, len(attrs), step):
+            drawn = attrs[start:start+step]
+            for a in drawn:
+                if a in self.numeric:
+                    splits[a] = self.best_threshold(a, lo, hi)
+                else:
+                    splits[a] = (split_information_gain(
+                        self.contingency_table(a, index)), None)
+            best = argmax(drawn, lambda a: splits[a][0])
+            if splits[best][0] != -infinity:
+                return best, splits[best][1]
+        return None, None
+
+    def best_threshold(self, attr, lo, hi):
+        """Return (gain, threshold) for the best binary split of the
+        examples in self.index[lo:hi] on the numeric attribute attr, or
+        (-infinity, None) if they all have the same value.  All candidate
+        thresholds are scored in one sweep over the presorted examples."""
+        segment = self.sorted[attr][lo:hi]
+        values = self.numeric[attr][segment]
+        candidates = np.flatnonzero(values[1:] > values[:-1])
+        if len(candidates) == 0:
+            return -infinity, None
+        nclasses = len(self.dataset.values[self.dataset.target])
+        below = np.zeros((len(segment), nclasses))
+        below[np.arange(len(segment)), self.classes[segment]] = \
+            1 if self.weights is None else self.weights[segment]
+        below = below.cumsum(axis=0)
+        total = below[-1]
+        below = below[candidates]
+        above = total - below
+        size = total.sum()
+        gains = (counts_entropies(total[np.newaxis, :])
+                 - (below.sum(1) * counts_entropies(below)
+                    + above.sum(1) * counts_entropies(above)) / size)
+        best = gains.argmax()
+        i = candidates[best]
+        return gains[best], (values[i] + values[i+1]) / 2.0
+
+    def class_counts(self, index):
+        """Count the examples in index of each target value (by code),
+        or add up their weights."""
+        return np.bincount(self.classes[index], self.example_weights(index),
+                           minlength=len(self.dataset.values[self.dataset.target]))
+
+    def contingency_table(self, attr, index):
+        """Return a table of counts, in one pass over the examples in index:
+        table[v][c] is the number (or total weight) with the v'th value of
+        attr and the c'th target value."""
+        nclasses = len(self.dataset.values[self.dataset.target])
+        nvalues = len(self.dataset.values[attr])
+        cells = self.columns[attr][index] * nclasses + self.classes[index]
+        table = np.bincount(cells, self.example_weights(index),
+                            minlength=nvalues * nclasses)
+        return table.reshape(nvalues, nclasses)
+
+    def example_weights(self, index):
+        "The weights of the examples in index, or None if unweighted."
+        if self.weights is None:
+            return None
+        return self.weights[index]
 
     def all_same_class(self, examples):
         "Are all these examples in the same target class?"
@@ -275,17 +1327,15 @@ class DecisionTreeLearner(Learner):
     def information_gain(self, attr, examples):
         """Given an attribute attr and set of examples (examples), return 
         the information gain for that attribute."""
-        original_entropy = entropy(self.split_by(self.dataset.target, examples))
-        size = len(examples)
-        
-        split = self.split_by(attr, examples) # Branches generated by splitting at this attr
-        weighted_entropies = 0
-        for sub in split:
-            sub_examples = sub[1]
-            this_entropy = entropy(self.split_by(self.dataset.target, sub_examples))
-            weighted_entropy = this_entropy * len(sub_examples)/size
-            weighted_entropies += weighted_entropy
-        return original_entropy - weighted_entropies
+        values = self.dataset.values
+        target = self.dataset.target
+        attr_index = dict(zip(values[attr], range(len(values[attr]))))
+        target_index = dict(zip(values[target], range(len(values[target]))))
+        table = [[0] * len(values[target]) for v in values[attr]]
+        for e in examples:
+            if e[attr] in attr_index and e[target] in target_index:
+                table[attr_index[e[attr]]][target_index[e[target]]] += 1
+        return split_information_gain(table)
     
     def split_by(self, attr, examples=None):
         """Return a list of (val, examples) pairs for each val of attr, assuming
@@ -296,44 +1346,82 @@ class DecisionTreeLearner(Learner):
                 for v in self.dataset.values[attr]]
 
     def prune(self, validation_examples):
-        """Use the given examples to prune the node that most increases accuracy over the
-        validation set."""
-        new_learner = DecisionTreeLearner() # Temporary learner to store/test new dt
-        new_learner.dataset = self.dataset
-        new_learner.dt = None
-        
-        while(isinstance(self.dt, DecisionTree)): # still have nodes to delete
-            original_accuracy = test(self, self.dataset, validation_examples)
-
-            best_node = None
-            best_tree = None
-            best_acc = 0
-            node_names = self.dt.uniquify()[:-1] # Try to delete every node, except the root
-            for removal in node_names:
-                new_tree = self.dt.copy(removal, self.dataset.examples, self.dataset.target)
-                new_learner.dt = new_tree
-                acc = test(new_learner, self.dataset, validation_examples)
-                if acc > best_acc: # Store the best node to remove for this iteration
-                    best_node = removal
-                    best_tree = new_tree
-                    best_acc = acc
-
-            # print 'Accuracy new <- old ', best_acc, original_accuracy, 'from', best_node
-            if best_acc >= original_accuracy: # Could find a viable node to delete
-                # print 'Deleting ', best_node, 'beneficial'
-                self.dt = best_tree
-            else: # No more improvements possible
-                # print 'Deleting ', best_node, 'not beneficial'
-                return
+        """Reduced-error pruning.  Route the validation examples through the
+        tree once, counting the examples of each target value that reach
+        each node.  Then, working bottom up, replace a node (other than the
+        root) by its majority training value whenever that would make no
+        more errors on those examples than its (already pruned) subtree."""
+        if not isinstance(self.dt, DecisionTree):
+            return
+        target = self.dataset.target
+        if isinstance(validation_examples, Examples) and \
+           validation_examples.values is self.dataset.values:
+            codes, numbers = validation_examples.rows(slice(None)), None
+        else:
+            codes, numbers = query_matrices(self.dataset, list(validation_examples))
+        compiled = self.compiled()
+        counts = compiled.node_counts(codes, codes[:, target], numbers)
+        reached = counts.sum(1)
+        target_index = self.dataset.value_index(target)
+        def errors_as_leaf(i, value):
+            if value not in target_index:
+                return reached[i]
+            return reached[i] - counts[i, target_index[value]]
+        errors = np.zeros(len(compiled.nodes), np.int64)
+        pruned = set()
+        # Children are numbered after their parents, so this is bottom up.
+        for i in reversed(range(len(compiled.nodes))):
+            node = compiled.nodes[i]
+            if not isinstance(node, DecisionTree):
+                errors[i] = errors_as_leaf(i, node)
+                continue
+            errors[i] = errors[compiled.branches(i)].sum()
+            if i > 0 and node.majority is not None and \
+               errors_as_leaf(i, node.majority) <= errors[i]:
+                errors[i] = errors_as_leaf(i, node.majority)
+                pruned.add(id(node))
+        def cut(node):
+            for val, subtree in node.branches.items():
+                if isinstance(subtree, DecisionTree):
+                    if id(subtree) in pruned:
+                        node.branches[val] = subtree.majority
+                    else:
+                        cut(subtree)
+        cut(self.dt)
+        self._compiled = None
 
 def entropy(values):
     """Takes input of List<Tuple(Val, Examples)>. Computes the entropy associated with the split
     among each Val."""
-    sizes = [len(sub[1]) for sub in values]
+    return counts_entropy([len(sub[1]) for sub in values])
+
+def counts_entropy(sizes):
+    """Computes the entropy of a split into groups of the given sizes."""
     totalSize = sum(sizes)
     proportions = [1.0*size/totalSize if totalSize > 0 else 0 for size in sizes]
     entropies = [prop * math.log(prop, 2) if prop > 0 else 0 for prop in proportions]
     return -sum(entropies)
+
+def counts_entropies(counts):
+    """Takes a 2-D array with a row of group sizes per split. Computes the
+    entropy of each split."""
+    totals = counts.sum(1)[:, np.newaxis]
+    proportions = counts / np.maximum(totals, 1.0)
+    logs = np.log2(np.where(proportions > 0, proportions, 1))
+    return -(proportions * logs).sum(1)
+
+def split_information_gain(table):
+    """Takes a contingency table: table[v][c] is the number of examples with 
+    the v'th value of the attribute split on and the c'th target value.
+    Computes the information gain of the split."""
+    if isinstance(table, np.ndarray):
+        table = table.tolist()
+    original_entropy = counts_entropy([sum(column) for column in zip(*table)])
+    size = sum(map(sum, table))
+    weighted_entropies = 0
+    for row in table:
+        weighted_entropies += counts_entropy(row) * sum(row)/size
+    return original_entropy - weighted_entropies
 #______________________________________________________________________________
 
 def test(learner, dataset, examples=None, verbose=0):
@@ -344,6 +1432,18 @@ def test(learner, dataset, examples=None, verbose=0):
     if examples == None: examples = dataset.examples
     #if we aren't given any examples, then your accuracy is 0.0
     if len(examples) == 0: return 0.0
+    #if the learner can predict a whole code matrix at once, the examples'
+    #  codes are in the dictionary it was trained with, and we've nothing
+    #  to print, score the examples in one batch
+    if hasattr(learner, 'predict_batch') and isinstance(examples, Examples) \
+       and examples.values is getattr(getattr(learner, 'dataset', None), 'values', None) \
+       and not verbose:
+        codes = examples.rows(slice(None))
+        targetvals = examples.values[dataset.target]
+        desired = [targetvals[c] for c in codes[:, dataset.target].tolist()]
+        output = learner.predict_batch(codes)
+        right = sum([o == d for (o, d) in zip(output, desired)])
+        return float(right) / len(examples)
     #initialize our 'right' or 'correct' count
     right = 0.0
     for example in examples:
@@ -366,65 +1466,97 @@ def test(learner, dataset, examples=None, verbose=0):
     #return the portion of test examples for which our learner was 'right'
     return right / len(examples)
 
-def train_and_test(learner, dataset, start, end):
+def train_and_test(learner, dataset, start, end, order=None):
     """Reserve dataset.examples[start:end] for test; train on the remainder.
-    Return the proportion of examples correct on the test examples."""
-    #In the examples variable, save the original examples in the dataset.
-    #  we'll be altering the dataset to pull out testing examples and 
-    #  will need to revert it in the end.
-    examples = dataset.examples
-    try:
-        #dataset.examples are the ones that it will TRAIN with - 
-        #  those falling before 'start' and after 'end'
-        dataset.examples = examples[:start] + examples[end:]
-        learner.dataset = dataset 
-        learner.train(dataset)
-        return test(learner, dataset, examples[start:end])
-    finally:
-        #at the end, be sure to revert the dataset to contain all of
-        #   its original examples
-        dataset.examples = examples
-
-def train_prune_and_test(learner, dataset, start, end, ratio = 0.66):
+    Return the proportion of examples correct on the test examples.
+    If order (a permutation of the example indices) is given, the examples
+    are taken in that order."""
+    #Neither set of examples is copied out of the dataset: the learner
+    #  trains on a view of the examples falling before 'start' and after
+    #  'end', and is tested on a view of the rest.
+    n = len(dataset.examples)
+    training = DataSetView(dataset, order, [(0, start), (end, n)])
+    testing = DataSetView(dataset, training.order, [(start, end)])
+    learner.train(training)
+    return test(learner, dataset, testing.examples)
+
+def train_prune_and_test(learner, dataset, start, end, ratio = 0.66, order=None):
     """Train and prune the tree using the given examples. Divides between training/validation
     according to given ratio. Tests on remaining examples."""
-    examples = dataset.examples
-    try:
-        all_training = examples[:start] + examples[end:]
-        num_training = int(ratio * len(all_training))
+    n = len(dataset.examples)
+    all_training = DataSetView(dataset, order, [(0, start), (end, n)])
+    num_training = int(ratio * len(all_training))
 
-        training = all_training[:num_training]
-        dataset.examples = training
-        learner.train(dataset)
-        size = len(learner.dt.uniquify())
-        
-        validation = all_training[num_training:]
-        #print 'Total training', len(all_training), 'Initial training', len(training), 'Pruning', len(validation), 'Testing', end-start
-        learner.prune(validation)
-        # final_size = len(learner.dt.uniquify())
-        #print 'Initial dt size', size, 'Final size', final_size
+    training, validation = all_training.split(num_training)
+    learner.train(training)
 
-        return test(learner, dataset, examples[start:end])
-    finally:
-        dataset.examples = examples
+    #print 'Total training', len(all_training), 'Initial training', len(training), 'Pruning', len(validation), 'Testing', end-start
+    learner.prune(validation.examples)
 
-def cross_validation(learner, dataset, prune=False, k=10, trials=1):
+    testing = DataSetView(dataset, all_training.order, [(start, end)])
+    return test(learner, dataset, testing.examples)
+
+def learner_factory(learner):
+    """Return a function that makes a fresh, untrained learner.
+    learner may be a Learner class, any other callable returning a learner,
+    or a Learner instance to be copied."""
+    if callable(learner):
+        return learner
+    return lambda: copy.deepcopy(learner)
+
+def cross_validation(learner, dataset, prune=False, k=10, trials=1,
+                     processes=1, seed=None):
     """Do k-fold cross_validate and return their mean.
     That is, keep out 1/k of the examples for testing on each of k runs.
-    Shuffle the examples first; If trials>1, average over several shuffles."""
-    examples = dataset.examples[:]
-    trials = [single_cross_validation(learner, shuffle(dataset), prune, k) \
-                       for trial in range(trials)]
-    dataset.examples = examples
+    Shuffle the examples first; If trials>1, average over several shuffles.
+    The dataset itself is left alone: each trial shuffles a permutation of
+    the example indices, and the folds are views through it.
+    learner is a factory (see learner_factory) called for a fresh learner
+    on every fold. The (trial, fold) jobs are run by pool_map in the given
+    number of processes; each reseeds random from (seed, trial, fold), so
+    the result does not depend on how many processes were used."""
+    order = range(len(dataset.examples))
+    orders = []
+    for trial in range(trials):
+        random.shuffle(order)
+        orders.append(np.array(order))
+    trials = cross_validation_runs(learner, dataset, prune, k, orders,
+                                   processes, seed)
     return sum(trials)/len(trials)
 
-def single_cross_validation(learner, dataset, prune, k):
+def single_cross_validation(learner, dataset, prune, k, order=None,
+                            processes=1, seed=None):
     """A single run of k-fold cross-validation, which returns the mean"""
-    num_testing = int(len(dataset.examples)/k)
-    trials = [train_prune_and_test(learner, dataset, i*num_testing, (i+1)*num_testing) if prune else \
-              train_and_test(learner, dataset, i*num_testing, (i+1)*num_testing) \
-              for i in range(k)]
-    return sum(trials)/len(trials)
+    return cross_validation_runs(learner, dataset, prune, k, [order],
+                                 processes, seed)[0]
+
+def cross_validation_runs(learner, dataset, prune, k, orders,
+                          processes=1, seed=None):
+    """Run k-fold cross-validation once for each order in orders, and
+    return the mean of the folds for each run."""
+    if seed is None:
+        seed = random.getrandbits(32)
+    jobs = [(trial, fold) for trial in range(len(orders)) for fold in range(k)]
+    state = random.getstate()
+    try:
+        results = pool_map(cross_validation_fold, jobs, processes,
+                           learner=learner_factory(learner), dataset=dataset,
+                           prune=prune, k=k, orders=orders, seed=seed)
+    finally:
+        random.setstate(state)
+    return [sum(results[trial*k:(trial+1)*k])/k for trial in range(len(orders))]
+
+def cross_validation_fold(job):
+    "Train and test one (trial, fold) job of cross_validation_runs."
+    trial, fold = job
+    random.seed(hash((shared['seed'], trial, fold)))
+    dataset, order = shared['dataset'], shared['orders'][trial]
+    num_testing = int(len(dataset.examples)/shared['k'])
+    start, end = fold*num_testing, (fold+1)*num_testing
+    learner = shared['learner']()
+    if shared['prune']:
+        return train_prune_and_test(learner, dataset, start, end, order=order)
+    return train_and_test(learner, dataset, start, end, order)
 
 def shuffle(dataset):
     random.shuffle(dataset.examples)
@@ -433,24 +1565,128 @@ def shuffle(dataset):
 def learningcurve(learner, dataset, trials=10, sizes=None):
     if sizes == None:
         sizes = range(2, len(dataset.examples)-10, 2)
+    order = range(len(dataset.examples))
     def score(learner, size):
-        return train_and_test(learner, shuffle(dataset), 0, size)
+        random.shuffle(order)
+        return train_and_test(learner, dataset, 0, size, np.array(order))
     return [(size, mean([score(learner, size) for t in range(trials)]))
             for size in sizes]
+
+#______________________________________________________________________________
+# Running independent jobs in a pool of processes
+
+shared = {}  # the state pool_map makes available to its jobs
+
+def pool_map(function, jobs, processes=1, **state):
+    """Return map(function, jobs), computed by a pool of processes (None
+    means one per CPU) unless processes is 1. The keyword arguments are
+    put into the module's shared dict while the jobs run. The workers are
+    forked after that, so they see it (datasets included) copy-on-write
+    instead of having it pickled for each job; only function, the jobs
+    and their results are pickled. A worker calling pool_map again runs
+    the inner jobs itself, since pool processes cannot have children."""
+    saved = shared.copy()
+    shared.clear()
+    shared.update(state)
+    try:
+        if processes == 1 or len(jobs) < 2 or \
+           multiprocessing.current_process().daemon:
+            return map(function, jobs)
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(function, jobs)
+        except:
+            pool.terminate()
+            raise
+        pool.close()
+        pool.join()
+        return results
+    finally:
+        shared.clear()
+        shared.update(saved)
+
+def train_in_shards(learner, dataset, shards=2, processes=1):
+    """Train a fresh learner (see learner_factory) on each of shards
+    consecutive slices of dataset, in a pool of processes, and return them
+    merged into one.  The learner needs a merge method; the workers send it
+    back without its transient attributes (see pool_result)."""
+    n = len(dataset.examples)
+    bounds = [(i*n//shards, (i+1)*n//shards) for i in range(shards)]
+    learners = pool_map(train_shard, bounds, processes,
+                        learner=learner_factory(learner), dataset=dataset)
+    merged = reduce(lambda a, b: a.merge(b), learners)
+    merged.dataset = dataset
+    return merged
+
+def train_shard(bounds):
+    "Train a learner on one slice of the dataset for train_in_shards."
+    learner = shared['learner']()
+    learner.train(DataSetView(shared['dataset'], None, [bounds]))
+    return pool_result(learner)
+
+def pool_result(learner):
+    """Return a learner trained by a pool job.  In a pool worker, its
+    transient attributes (the dataset, and anything only needed while
+    training) are deleted first, so they aren't pickled back with it;
+    whoever gets it (see EnsembleLearner.train) should set the dataset."""
+    if multiprocessing.current_process().daemon:
+        for name in getattr(learner, 'transient', ()):
+            learner.__dict__.pop(name, None)
+    return learner
+
 #______________________________________________________________________________
 
 ### These are testing functions. Each test's purpose is pretty straightforward.
 ### Just call test<whatever>() from the interpreter.
 
-simpleData = DataSet(examples=[[0, 0, 0], [0, 0, 1], [1, 1, 0], [1, 1, 1]], attrs=[[0, 1], [0, 1], [0,1]], target=0)
+simpleData = register_dataset(name='simple', examples=[[0, 0, 0], [0, 0, 1], [1, 1, 0], [1, 1, 1]], attrs=[[0, 1], [0, 1], [0,1]], target=0)
 
 def testAll():
+    testColumns()
+    testCache()
+    testViews()
     testEntropy()
     testDT()
     testAccuracy()
     testPruning()
+    testNaiveBayes()
+    testNearestNeighbor()
+    testLSH()
+    testEnsemble()
+    testRandomForest()
+    testBoosting()
     testCrossV()
     
+def testColumns():
+    print "DataSet - checking columnar storage round-trips the examples"
+    check(list(orings.column('Temp'))[:3], [66, 70, 69])
+    codes = zoo.code_matrix()[0]
+    check([zoo.values[a][c] for a, c in enumerate(codes)], zoo.examples[0])
+    check(iris.column('class').dtype, np.int32)
+    check(iris.column(0).dtype, np.float64)
+    big = DataSet(examples=[[3000000000, 'a'], [5, 'b'], [7, 'a']])
+    check(list(big.column(0)), [3000000000, 5, 7])
+    print
+
+def testCache():
+    print "DataSet - checking the binary cache gives the same examples as the csv"
+    for name in ['orings', 'zoo', 'iris', 'mushroom']:
+        check(list(DataSet(name=name).examples),
+              list(DataSet(name=name, cache=False).examples))
+    print
+
+def testViews():
+    print "DataSetView - checking views pick out examples without copying them"
+    order = np.arange(len(zoo.examples))[::-1]
+    training, testing = DataSetView(zoo, order).split(90)
+    check(testing.examples[0], zoo.examples[10])
+    check(len(training) + len(testing), len(zoo.examples))
+    check(list(testing.column('legs')), [zoo.examples[i][13] for i in range(10, -1, -1)])
+    examples = list(zoo.examples)
+    cross_validation(DecisionTreeLearner(), zoo, False, 5, 1)
+    check(list(zoo.examples), examples)
+    print
+
 def testEntropy():
     print "Entropy - checking computed entropies" 
     whole_set = [(1, [[1, 1], [1,2]])]
@@ -490,12 +1726,17 @@ def testDT():
     
 def testAccuracy():
     print "Learner - checking accuracy"
-    iris1 = train_and_test(DecisionTreeLearner(), iris, 135, 150)
+    iris1 = train_and_test(DecisionTreeLearner(numeric_splits=False), iris, 135, 150)
     check(iris1, 0.66666666666666663)
     orings1 = 0.7692307692307692
-    check(orings1, train_and_test(DecisionTreeLearner(), orings, 10, 23))
+    check(orings1, train_and_test(DecisionTreeLearner(numeric_splits=False), orings, 10, 23))
     zoo1 = 0.71999999999999997
-    check(zoo1, train_and_test(DecisionTreeLearner(), zoo, 75, 100))
+    check(zoo1, train_and_test(DecisionTreeLearner(numeric_splits=False), zoo, 75, 100))
+    print
+
+    print "Numeric splits - checking thresholds do better on continuous data"
+    better(iris1, train_and_test(DecisionTreeLearner(), iris, 135, 150))
+    better(orings1, train_and_test(DecisionTreeLearner(), orings, 10, 23))
     print
 
     print "Cross validation - checking for reasonable results"
@@ -514,20 +1755,203 @@ def testPruning():
     zoo2 = train_prune_and_test(DecisionTreeLearner(), zoo, 70, 100, 0.66) #Standard 2/3-1/3 split
     better(zoo1, zoo2)
 
+    print "Pruning - checking examples of another DataSet count as they should"
+    rows = zoo.examples[:]
+    both = DataSet(examples=rows, target=zoo.target, exclude=[0])
+    pruned = DecisionTreeLearner()
+    pruned.train(DataSetView(both, None, [(0, 60)]))
+    pruned.prune(DataSetView(both, None, [(60, len(rows))]).examples)
+    apart = DecisionTreeLearner()
+    apart.train(DataSet(examples=rows[:60], target=zoo.target, exclude=[0]))
+    apart.prune(DataSet(examples=rows[60:], target=zoo.target, exclude=[0]).examples)
+    check(map(apart.predict, rows), map(pruned.predict, rows))
+
+def testNaiveBayes():
+    print "Naive Bayes - checking batch and single predictions agree"
+    learner = NaiveBayesLearner()
+    learner.train(DataSetView(zoo, None, [(0, 75)]))
+    examples = zoo.examples[75:]
+    check(learner.predict_batch(zoo.examples.rows(slice(75, None))),
+          [learner.predict(zoo.sanitize(e)) for e in examples])
+    check(learner.P('fish', 1, 'unseen'),
+          1.0 / (learner.N('fish', 1, None) + len(zoo.values[1])))
+    better(0.9, train_and_test(NaiveBayesLearner(), mush, 7000, 8124))
+    print "Naive Bayes - checking examples of another DataSet score as one by one"
+    training = DataSet(examples=[['b', 'y', 'yes'], ['a', 'y', 'yes'], ['b', 'x', 'yes'],
+                                 ['b', 'y', 'no'], ['a', 'y', 'no'], ['a', 'y', 'no']])
+    other = DataSet(examples=[['b', 'y', 'yes'], ['b', 'y', 'no'], ['a', 'x', 'yes'],
+                              ['b', 'y', 'no'], ['a', 'y', 'yes'], ['c', 'z', 'maybe']])
+    learner.train(training)
+    examples = DataSetView(other, None, [(0, 5)]).examples
+    check(test(learner, other, examples),
+          sum([learner.predict(e) == e[-1] for e in examples]) / 5.0)
+    print
+
+    print "Naive Bayes - checking online and merged training count the same"
+    whole = NaiveBayesLearner()
+    whole.train(mush)
+    online = NaiveBayesLearner()
+    online.train(DataSetView(mush, None, [(0, 0)]))
+    for start in range(0, 8124, 1000):
+        online.partial_fit(mush.examples[start:start+1000])
+    check(online.counts.tolist(), whole.counts.tolist())
+    merged = train_in_shards(NaiveBayesLearner, mush, 4, processes=None)
+    check(merged.counts.tolist(), whole.counts.tolist())
+    print
+
+    print "Gaussian Naive Bayes - checking it does better on continuous data"
+    better(cross_validation(NaiveBayesLearner, wine, False, 5, 1),
+           cross_validation(lambda: NaiveBayesLearner(gaussian=True), wine, False, 5, 1))
+    whole = NaiveBayesLearner(gaussian=True)
+    whole.train(iris)
+    merged = train_in_shards(lambda: NaiveBayesLearner(gaussian=True), iris, 3)
+    check(np.allclose(merged.m2, whole.m2), True)
+    print
+
+def testNearestNeighbor():
+    print "Nearest neighbor - checking the trees find the same neighbors as a scan"
+    training = DataSetView(wine, None, [(0, 140)])
+    kd, ball, scan = [NearestNeighborLearner(5, 'euclidean', index)
+                      for index in ('kd', 'ball', None)]
+    def neighbors(learner):
+        learner.train(training)
+        return [learner.tree.search(learner.encode(e), 5) for e in wine.examples[140:]]
+    check(neighbors(kd), neighbors(scan))
+    check(neighbors(ball), neighbors(scan))
+    better(train_and_test(NearestNeighborLearner(3), iris, 130, 150),
+           train_and_test(NearestNeighborLearner(3, 'euclidean'), iris, 130, 150))
+    print
+
+    print "Nearest neighbor - checking batch and single predictions agree"
+    learner = NearestNeighborLearner(3)
+    learner.train(DataSetView(tictactoe, None, [(0, 800)]))
+    check(learner.predict_batch(tictactoe.examples.rows(slice(800, None))),
+          [learner.predict(tictactoe.sanitize(e)) for e in tictactoe.examples[800:]])
+    print
+
+    print "Nearest neighbor - checking an overridden distance is the one used"
+    class LegsCount(NearestNeighborLearner):
+        def distance(self, e1, e2):
+            return mean_boolean_error(e1, e2) + (e1[13] != e2[13])
+    learner = LegsCount()
+    learner.train(DataSetView(zoo, None, [(0, 75)]))
+    training = map(zoo.sanitize, zoo.examples[:75])
+    def nearest(e):
+        e = zoo.sanitize(e)
+        return min(range(75), key=lambda i: (learner.distance(training[i], e), i))
+    check(learner.predict_batch(zoo.examples.rows(slice(75, None))),
+          [zoo.examples[nearest(e)][zoo.target] for e in zoo.examples[75:]])
+    print
+
+def testLSH():
+    print "LSH - recall and time per query against an exact scan on mushroom"
+    training = DataSetView(mush, None, [(0, 7000)])
+    scan = NearestNeighborLearner(5, index=None)
+    scan.train(training)
+    queries = scan.encode_codes(mush.examples.rows(slice(7000, None)))
+    start = time.time()
+    exact = [scan.tree.search(q, 5) for q in queries]
+    scan_time = (time.time() - start) / len(queries)
+    print "scan: %.2f ms per query" % (1000 * scan_time)
+    for tables in (1, 4, 16):
+        learner = NearestNeighborLearner(5, index='lsh', tables=tables)
+        learner.train(training)
+        index = learner.tree
+        start = time.time()
+        found = [index.search(q, 5) for q in queries]
+        lsh_time = (time.time() - start) / len(queries)
+        ## A neighbor counts as recalled if it's as close as the true 5th
+        recall = mean([len([d for (d, i) in f if d <= e[-1][0]]) / 5.0
+                       for (f, e) in zip(found, exact)])
+        print "%2d tables: recall %.3f, %.2f ms per query, %.0f candidates" % (
+            tables, recall, 1000 * lsh_time,
+            mean([len(index.candidates(q)) for q in queries]))
+    better(0.9, recall)
+    print "LSH - checking the learner passes on the tables and bits"
+    learner = NearestNeighborLearner(5, index='lsh', tables=3, bits=7)
+    learner.train(training)
+    check((len(learner.tree.samples), learner.tree.bits), (3, 7))
+    print
+
+def testEnsemble():
+    print "Ensemble - checking a pool of processes gives the same votes"
+    def members():
+        return [DecisionTreeLearner(), NaiveBayesLearner(), NearestNeighborLearner(3)]
+    serial = train_and_test(EnsembleLearner(members()), zoo, 75, 100)
+    check(train_and_test(EnsembleLearner(members(), processes=None), zoo, 75, 100), serial)
+    print "Ensemble - checking a heavily weighted learner decides the vote"
+    check(train_and_test(EnsembleLearner(members(), [0, 5, 1]), zoo, 75, 100),
+          train_and_test(NaiveBayesLearner(), zoo, 75, 100))
+    print "Ensemble - checking a copy of a trained learner still works"
+    for learner in members():
+        learner.train(zoo)
+        check(test(copy.deepcopy(learner), zoo), test(learner, zoo))
+    print
+
+def testRandomForest():
+    print "Random forest - checking it does better than a single tree"
+    better(cross_validation(DecisionTreeLearner, tictactoe, False, 5, 1),
+           cross_validation(lambda: RandomForestLearner(25), tictactoe, False, 5, 1))
+    print "Random forest - checking the out-of-bag estimate is reasonable"
+    forest = RandomForestLearner(25, seed=1, processes=None)
+    forest.train(wine)
+    better(0.8, forest.oob_accuracy)
+    print "Random forest - checking constant attributes don't cut trees short"
+    constant = DataSet(examples=[[0, 0, 0, 0, 0, x, x > 5] for x in range(10)])
+    tree = DecisionTreeLearner(max_features=1)
+    tree.train(constant)
+    check(test(tree, constant), 1.0)
+    print "Random forest - checking numbers it hasn't seen go the tree's way"
+    sizes = DataSet(examples=[[x, x < 50 and 'small' or 'big'] for x in range(0, 99, 2)])
+    forest = RandomForestLearner(10, seed=1)
+    forest.train(sizes)
+    tree = DecisionTreeLearner()
+    tree.train(sizes)
+    check([forest.predict([x, None]) for x in [3, 51, 97]],
+          [tree.predict([x, None]) for x in [3, 51, 97]])
+    print
+
+def testBoosting():
+    print "Weighted examples - checking a weight counts like repeating the example"
+    weights = [1, 2, 3] * 50
+    weighted = DecisionTreeLearner()
+    weighted.train(iris, weights)
+    repeated = DecisionTreeLearner()
+    repeated.train(DataSetView(iris, np.repeat(np.arange(150), weights)))
+    check(repr(weighted.dt), repr(repeated.dt))
+    print "AdaBoost - checking boosted stumps do better than one stump"
+    better(cross_validation(lambda: DecisionTreeLearner(max_depth=1), tictactoe, False, 5, 1),
+           cross_validation(lambda: AdaBoostLearner(100), tictactoe, False, 5, 1))
+    print "AdaBoost - checking numbers it hasn't seen go the stump's way"
+    sizes = DataSet(examples=[[x, x < 50 and 'small' or 'big'] for x in range(0, 99, 2)])
+    stump = DecisionTreeLearner(max_depth=1)
+    stump.train(sizes)
+    boosted = AdaBoostLearner(5)
+    boosted.train(sizes)
+    check([boosted.predict([x, None]) for x in [3, 51, 97]],
+          [stump.predict([x, None]) for x in [3, 51, 97]])
+    print "AdaBoost - checking no rounds gives the one unweighted stump"
+    stump = DecisionTreeLearner(max_depth=1)
+    stump.train(zoo)
+    boosted = AdaBoostLearner(0)
+    boosted.train(zoo)
+    check(test(boosted, zoo), test(stump, zoo))
+    print
+
 def testCrossV():
     print "Iris - ID3 and ID3 with pruning"
-    iris_p = cross_validation(DecisionTreeLearner(), iris, True, 5, 10)
-    iris_np = cross_validation(DecisionTreeLearner(), iris, False, 5, 10)
+    iris_p = cross_validation(DecisionTreeLearner, iris, True, 5, 10, processes=None)
+    iris_np = cross_validation(DecisionTreeLearner, iris, False, 5, 10, processes=None)
     print "Iris 5-fold validated 10 times", "Pruning", iris_p, "No pruning", iris_np
 
     print "Mush - ID3 and ID3 with pruning"
-    m_p = cross_validation(DecisionTreeLearner(), mush, True, 5, 10)
-    m_np = cross_validation(DecisionTreeLearner(), mush, False, 5, 10)
+    m_p = cross_validation(DecisionTreeLearner, mush, True, 5, 10, processes=None)
+    m_np = cross_validation(DecisionTreeLearner, mush, False, 5, 10, processes=None)
     print "Mush 5-fold validated 10 times", "Pruning", m_p, "No pruning", m_np
 
     print "Restaurant - ID3 and ID3 with pruning"
-    r_p = cross_validation(DecisionTreeLearner(), restaurant, True, 5, 10)
-    r_np = cross_validation(DecisionTreeLearner(), restaurant, False, 5, 10)
+    r_p = cross_validation(DecisionTreeLearner, restaurant, True, 5, 10, processes=None)
+    r_np = cross_validation(DecisionTreeLearner, restaurant, False, 5, 10, processes=None)
     print "Restaurant 5-fold validated 10 times", "Pruning", r_p, "No pruning", r_np
 
 
@@ -1,9 +1,10 @@
-import math, random
+import os, math, random, multiprocessing, shutil, tempfile
+import numpy as np
 
 
 #
-#  Arrays are represented by lists of (equal-sized) lists. There are
-#  packages, like numpy, that will speed up the indexing.
+#  Arrays are built as lists of (equal-sized) lists, then held by the
+#  network as numpy arrays, so that each layer is a matrix product.
 #
 def makeZeroArray(m, n):
     """Create an m x n array filled with zero values."""
@@ -21,33 +22,63 @@ def makeRandomArray(m, n, lower=-2.0, upper=2.0):
 
 
 #
-#  The activation function and its derivative. We provide the sigmoid function
-#  and the tanh function, a commonly-used alternative.
+#  The activation functions and their derivatives. We provide the sigmoid
+#  function, the tanh function (a commonly-used alternative) and the
+#  rectifier, ReLU.  They work elementwise on arrays; given out, they write
+#  into it rather than making a new array.
 #
-def sigmoid(x):
+def sigmoid(x, out=None):
     """Return 1/(1+e^-x)."""
-    return 1.0 / (1.0 + math.exp(-x))
-
-def dsigmoid(y):
+    if out is None:
+	return 1.0 / (1.0 + np.exp(-x))
+    np.negative(x, out)
+    np.exp(out, out)
+    out += 1.0
+    return np.reciprocal(out, out)
+
+def dsigmoid(y, out=None):
     """Return the derivative of sigmoid, based on the value of the function."""
-    return y * (1.0 - y)
+    if out is None:
+	return y * (1.0 - y)
+    np.subtract(1.0, y, out)
+    out *= y
+    return out
 
-def tanh(x):
+def tanh(x, out=None):
     """Return an alternative to sigmoid."""
-    return math.tanh(x)
+    return np.tanh(x, out)
 
-def dtanh(y):
+def dtanh(y, out=None):
     """Return the derivative of the alternative to sigmoid,
        based on the value of the function."""
-    return 1.0 - y * y
+    if out is None:
+	return 1.0 - y * y
+    np.multiply(y, y, out)
+    return np.subtract(1.0, out, out)
+
+def relu(x, out=None):
+    """Return max(x, 0)."""
+    return np.maximum(x, 0.0, out)
+
+def drelu(y, out=None):
+    """Return the derivative of relu, based on the value of the function."""
+    if out is None:
+	return (y > 0) * 1.0
+    return np.greater(y, 0.0, out)
+
+activationFunctions = {'sigmoid': (sigmoid, dsigmoid),
+		       'tanh': (tanh, dtanh),
+		       'relu': (relu, drelu)}
 
 
 #
-#  The neural network itself. It contains three lists (the activation values
-#  for each of the layers) and four arrays (two for the weights and two more
-#  for the most recent changes--for momentum).
+#  A network of any number of fully connected layers.  The weights (and the
+#  most recent changes, for momentum) of all the layers are views into one
+#  flat array each; the values, sums and deltas of the layers for a batch of
+#  examples go in arrays kept from one step to the next, so that training
+#  allocates nothing once the first batch has been seen.
 #
-class neuralNet:
+class multiLayerNet:
     class sizeMismatch(Exception):
 	"""Exception raised when the wrong number of input values
 	   is offered."""
@@ -56,149 +87,539 @@ class neuralNet:
 	    self.actual = actual
 	def __str__(self):
 	    return "Incorrect number of inputs: " + str(self.desired) + \
-                   " required, " + str(self.actual) + " received."
-
-
-    def __init__(self, nInput, nHidden, nOutput):
-	self.numInput = nInput + 1   # one extra for the bias node
-	self.numHidden = nHidden + 1 # one extra for the bias node
-	self.numOutput = nOutput
-	self.inputLayer = [1.0] * self.numInput
-	self.hiddenLayer = [1.0] * self.numHidden
-	self.outputLayer = [1.0] * self.numOutput
-	self.ihWeights = makeRandomArray(self.numInput, self.numHidden - 1)
-	self.hoWeights = makeRandomArray(self.numHidden, self.numOutput)
-	self.ihChanges = makeZeroArray(self.numInput, self.numHidden - 1)
-	self.hoChanges = makeZeroArray(self.numHidden, self.numOutput)
-	self.actFunction = sigmoid
-	self.dactFunction = dsigmoid
+		   " required, " + str(self.actual) + " received."
+
+
+    def __init__(self, sizes, activations='sigmoid'):
+	"""sizes lists the number of nodes in each layer, inputs first and
+	   outputs last (not counting the bias nodes).  activations names
+	   the activation function of every layer after the inputs
+	   ('sigmoid', 'tanh' or 'relu'), or gives a list of names, one
+	   per layer."""
+	self.sizes = list(sizes)
+	if isinstance(activations, str):
+	    activations = [activations] * (len(sizes) - 1)
+	self.activations = list(activations)
+	# Layer l's weights have a row per node of layer l-1, bias last.
+	shapes = [(sizes[l] + 1, sizes[l + 1]) for l in range(len(sizes) - 1)]
+	self.shapes = shapes
+	size = sum([m * n for (m, n) in shapes])
+	self.setWeightBuffer(np.empty(size))
+	for (weights, (m, n)) in zip(self.weights, shapes):
+	    weights[:] = makeRandomArray(m, n)
+	self.changeBuffer = np.zeros(size)
+	self.changes = self.layerViews(self.changeBuffer)
+	self.scratchBuffer = np.zeros(size)
+	self.scratch = self.layerViews(self.scratchBuffer)
+	self.capacity = 0
+
+
+    def layerViews(self, buffer):
+	"""Returns a list of matrices, one per layer and each shaped like
+	   that layer's weights, that are views into a flat buffer."""
+	views = []
+	start = 0
+	for (m, n) in self.shapes:
+	    views.append(buffer[start:start + m * n].reshape(m, n))
+	    start += m * n
+	return views
+
+
+    def setWeightBuffer(self, buffer):
+	"""Makes the flat buffer hold the weights of all the layers."""
+	self.weightBuffer = buffer
+	self.weights = self.layerViews(buffer)
+
+
+    def shareWeights(self):
+	"""Moves the weights into shared memory, so that processes forked
+	   afterwards see the changes made to them, and make theirs seen."""
+	shared = multiprocessing.RawArray('d', len(self.weightBuffer))
+	buffer = np.frombuffer(shared)
+	buffer[:] = self.weightBuffer
+	self.setWeightBuffer(buffer)
+
+
+    def reserve(self, size):
+	"""Makes sure the layer buffers can hold a batch of size examples:
+	   values[l] has a row of layer l's values per example, then a
+	   column of ones for the bias; sums[l] and deltas[l] (for each
+	   layer after the inputs) hold the weighted sums and the deltas."""
+	if size <= self.capacity:
+	    return
+	self.capacity = size
+	self.values = [np.ones((size, n + 1)) for n in self.sizes]
+	self.sums = [None] + [np.empty((size, n)) for n in self.sizes[1:]]
+	self.deltas = [None] + [np.empty((size, n)) for n in self.sizes[1:]]
+
+
+    def forward(self, inputs):
+	"""Carries out forward propagation for a matrix of inputs, a row
+	   per example, filling in the layer buffers.  Returns the values
+	   of the output layer (a view into them)."""
+	if inputs.shape[1] != self.sizes[0]:
+	    raise self.sizeMismatch(self.sizes[0], inputs.shape[1])
+	size = len(inputs)
+	self.reserve(size)
+	self.values[0][:size, :-1] = inputs
+	for l in range(1, len(self.sizes)):
+	    function = activationFunctions[self.activations[l - 1]][0]
+	    sums = self.sums[l][:size]
+	    np.dot(self.values[l - 1][:size], self.weights[l - 1], sums)
+	    function(sums, self.values[l][:size, :-1])
+	return self.values[-1][:size, :-1]
 
 
     def evaluate(self, inputs):
-	"""Carries out forward propagation on the neural net."""
-	if len(inputs) != self.numInput - 1:
-	    raise self.sizeMismatch(self.numInput - 1, len(inputs))
-
-	# Create the input layer.
-	self.inputLayer = inputs + [1.0]
-
-	# Evaluate the hidden layer.
-	for h in xrange(self.numHidden - 1):
-	    accum = 0.0
-	    for i in xrange(self.numInput):
-		accum += self.ihWeights[i][h] * self.inputLayer[i]
-	    self.hiddenLayer[h] = self.actFunction(accum)
-
-	# Evaluate the output layer.
-	for o in xrange(self.numOutput):
-	    accum = 0.0
-	    for h in xrange(self.numHidden):
-		accum += self.hoWeights[h][o] * self.hiddenLayer[h]
-	    self.outputLayer[o] = self.actFunction(accum)
-
-	# Return a *copy* of the output layer.
-	return self.outputLayer[:]
+	"""Carries out forward propagation on the network for one list of
+	   inputs, and returns the list of outputs."""
+	if len(inputs) != self.sizes[0]:
+	    raise self.sizeMismatch(self.sizes[0], len(inputs))
+	return self.forward(np.array([inputs], float))[0].tolist()
 
 
     def test(self, data):
 	"""Tests the neural net on a list of values.
-           Requires a list of input-output pairs.
-           Returns a list of triples:
-           (input, desired-output, actual-output)."""
-	return map(lambda (x,y): (x,y,self.evaluate(x)), data)
+	   Requires a list of input-output pairs.
+	   Returns a list of triples:
+	   (input, desired-output, actual-output)."""
+	outputs = self.evaluate_batch([x for (x,y) in data]).tolist()
+	return [(x,y,output) for ((x,y),output) in zip(data, outputs)]
+
+
+    def evaluate_batch(self, inputs, chunkSize=1024):
+	"""Carries out forward propagation for a matrix of inputs, a row
+	   per example, and returns the matrix of outputs.  Unlike evaluate
+	   it leaves the layer buffers alone, working chunkSize rows at a
+	   time in arrays of its own, so memory stays bounded however many
+	   rows there are and several threads can share one trained net."""
+	inputs = np.asarray(inputs, float)
+	if len(inputs) == 0:
+	    return np.empty((0, self.sizes[-1]))
+	inputs = inputs.reshape(len(inputs), -1)
+	if inputs.shape[1] != self.sizes[0]:
+	    raise self.sizeMismatch(self.sizes[0], inputs.shape[1])
+	outputs = np.empty((len(inputs), self.sizes[-1]))
+	for start in xrange(0, len(inputs), chunkSize):
+	    values = inputs[start:start + chunkSize]
+	    for (weights, activation) in zip(self.weights, self.activations):
+		sums = np.dot(values, weights[:-1])
+		sums += weights[-1]
+		values = activationFunctions[activation][0](sums, sums)
+	    outputs[start:start + chunkSize] = values
+	return outputs
 
 
     def train(self, data,
-              learningRate=0.5, momentumFactor=0.1,
-              iterations=1000, printInterval=100):
+	      learningRate=0.5, momentumFactor=0.1,
+	      iterations=1000, printInterval=100, batchSize=None,
+	      processes=1, validation=None, patience=None, checkpoint=None):
 	"""Carries out a training cycle on the neural net.
-           The training data must be a list of input-output pairs."""
-        if printInterval <= 0:
-            printCount = 0
-            leftOver = iterations
-        else:
-            printCount = iterations / printInterval
-            leftOver   = iterations % printInterval
-
-	def onePass():
-	    for (x,y) in data:
-		self.backPropagate(x, y, learningRate, momentumFactor)
+	   The training data must be a list of input-output pairs.
+	   With batchSize, each pass shuffles the pairs into batches of
+	   that many, and updates the weights once per batch (see
+	   backPropagateBatch) instead of once per pair.  With more than
+	   one process (None means one per CPU), each batch (the whole
+	   data, if no batchSize is given) is split among that many
+	   worker processes, whose gradients are added up for the
+	   update (see gradientWorkers).  The result is the same as
+	   training with that batchSize in one process.  Note that it
+	   is not the same as the default, one update per pair: an
+	   update for a batch averages its pairs' changes, so a pass
+	   moves the weights less, and a larger learningRate is needed
+	   to learn as much (on xor, 2.0 matches what 0.5 does one
+	   pair at a time, where 0.5 over the whole data does worse).
+
+	   validation is a list of input-output pairs whose error is
+	   measured after each pass; the weights with the least of it
+	   are kept, and put back when training ends.  With patience,
+	   training stops once that many passes have gone by without
+	   improving on them.  checkpoint names a file to which they
+	   are also saved (see saveCheckpoint), each time they improve
+	   (or, without validation, the weights after every pass); if
+	   the file exists already, training resumes from it.
+	   Returns the list of validation errors, one per pass."""
+	start, bestError = 0, None
+	if checkpoint and os.path.exists(checkpoint):
+	    start, bestError = self.loadCheckpoint(checkpoint)
+	if validation:
+	    validationInputs, validationOutputs = self.dataMatrices(validation)
+	    bestWeights = self.weightBuffer.copy()
+	    bestEpoch = start - 1
+	validationErrors = []
 
 	def onePassWithError():
-	    error = 0.0
-	    for (x,y) in data:
-		error += self.backPropagate(x, y, learningRate, momentumFactor)
-	    return error
-
-        for i in xrange(printCount):
-            for j in range(printInterval-1):
-                onePass()
-            print "error %-14f" % onePassWithError()
-        for i in xrange(leftOver):
-            onePass()
+	    return self.backPropagateRows(inputs, outputs,
+					  learningRate, momentumFactor)
+	onePass = onePassWithError
+
+	workers = None
+	if processes != 1:
+	    workers = gradientWorkers(self, data, processes)
+	    batchSize = batchSize or len(data)
+
+	# The pairs become two matrices (shuffled by an index array, for
+	# batches).
+	inputs, outputs = self.dataMatrices(data)
+	if batchSize:
+	    shuffler = np.random.RandomState(random.getrandbits(32))
+	    def onePassWithError():
+		order = shuffler.permutation(len(inputs))
+		error = 0.0
+		for start in xrange(0, len(order), batchSize):
+		    batch = order[start:start + batchSize]
+		    if workers:
+			error += workers.backPropagate(batch,
+						       learningRate, momentumFactor)
+		    else:
+			error += self.backPropagateBatch(inputs[batch], outputs[batch],
+							 learningRate, momentumFactor)
+		return error
+	    onePass = onePassWithError
+
+	try:
+	    for epoch in xrange(start, iterations):
+		if printInterval > 0 and (epoch + 1) % printInterval == 0:
+		    print "error %-14f" % onePassWithError()
+		else:
+		    onePass()
+		if not validation:
+		    if checkpoint:
+			self.saveCheckpoint(checkpoint, epoch + 1)
+		    continue
+		error = self.error(validationInputs, validationOutputs)
+		validationErrors.append(error)
+		if bestError is None or error < bestError:
+		    bestEpoch, bestError = epoch, error
+		    bestWeights[:] = self.weightBuffer
+		    if checkpoint:
+			self.saveCheckpoint(checkpoint, epoch + 1, bestError)
+		elif patience and epoch - bestEpoch >= patience:
+		    break
+	finally:
+	    if workers:
+		workers.close()
+	if validation:
+	    self.weightBuffer[:] = bestWeights
+	return validationErrors
+
+
+    def error(self, inputs, desiredResults):
+	"""Returns the total (half the sum of squares of the) errors of
+	   the net on a matrix of inputs, a row per example."""
+	errors = self.evaluate_batch(inputs)
+	errors -= desiredResults
+	return 0.5 * float(np.dot(errors.ravel(), errors.ravel()))
+
+
+    def saveCheckpoint(self, filename, epoch=0, bestError=None):
+	"""Saves the sizes, weights and most recent changes of the net,
+	   with the number of passes made and the validation error, to a
+	   binary file.  The file is written under another name first,
+	   so that an interrupted save leaves the last checkpoint whole."""
+	temporary = filename + '.tmp'
+	output = open(temporary, 'wb')
+	try:
+	    np.savez(output, sizes=self.sizes, weights=self.weightBuffer,
+		     changes=self.changeBuffer, epoch=epoch,
+		     bestError=np.nan if bestError is None else bestError)
+	finally:
+	    output.close()
+	os.rename(temporary, filename)
+
+
+    def loadCheckpoint(self, filename):
+	"""Loads the weights and changes saved by saveCheckpoint into the
+	   net, which must have the same sizes.  Returns the number of
+	   passes made and the validation error (or None)."""
+	saved = np.load(filename)
+	try:
+	    if list(saved['sizes']) != self.sizes:
+		raise ValueError("checkpoint %s is for a net of sizes %s, not %s"
+				 % (filename, list(saved['sizes']), self.sizes))
+	    self.weightBuffer[:] = saved['weights']
+	    self.changeBuffer[:] = saved['changes']
+	    bestError = float(saved['bestError'])
+	    return int(saved['epoch']), None if np.isnan(bestError) else bestError
+	finally:
+	    saved.close()
 
 
     def backPropagate(self,
 		      inputs, desiredResult,
 		      learningRate, momentumFactor):
-        """The basic back propagation algorithm for adjusting weights."""
-
-	# Carry out the forward pass.
-	outputs = self.evaluate(inputs)
-
-	# Compute the deltas at the output layer.
-	outputDeltas = [0.0] * self.numOutput
-	for o in xrange(self.numOutput):
-	    outputDeltas[o] = self.dactFunction(outputs[o]) * \
-		              (desiredResult[o] - outputs[o])
-
-	# Compute the deltas at the hidden layer.
-	hiddenDeltas = [0.0] * self.numHidden
-	for h in xrange(self.numHidden - 1):
-	    error = 0.0
-	    for o in xrange(self.numOutput):
-		error += outputDeltas[o] * self.hoWeights[h][o]
-	    hiddenDeltas[h] = self.dactFunction(self.hiddenLayer[h]) * error
-
-	# Update the weights and changes for the hidden-output layers.
-	for h in xrange(self.numHidden):
-	    for o in xrange(self.numOutput):
-		change = outputDeltas[o] * self.hiddenLayer[h]
-		self.hoWeights[h][o] += learningRate * change + \
- 		                        momentumFactor * self.hoChanges[h][o]
-		self.hoChanges[h][o] = change
-
-	# Update the weights and changes for the input-hidden layers.
-	for i in xrange(self.numInput):
-	    for h in xrange(self.numHidden - 1):
-		change = hiddenDeltas[h] * self.inputLayer[i]
-		self.ihWeights[i][h] += learningRate * change + \
-		                        momentumFactor * self.ihChanges[i][h]
-		self.ihChanges[i][h] = change
-
-	# Compute the (half the sum of squares of the) errors.
-	squareErrors = 0.0
-	for o in xrange(self.numOutput):
-	    squareErrors += (desiredResult[o] - self.outputLayer[o])**2
-	return 0.5 * squareErrors
+	"""The basic back propagation algorithm for adjusting weights,
+	   for one example."""
+	if len(inputs) != self.sizes[0]:
+	    raise self.sizeMismatch(self.sizes[0], len(inputs))
+	return self.backPropagateBatch(np.array([inputs], float),
+				       np.array([desiredResult], float),
+				       learningRate, momentumFactor)
+
+
+    def backPropagateRows(self, inputs, desiredResults,
+			  learningRate, momentumFactor):
+	"""Back propagation one example at a time, in order, for each row
+	   of inputs and desiredResults, as backPropagate does; but with the
+	   layers' views and functions looked up once for them all, since
+	   for a small net that is most of the time taken.  (Even so, a net
+	   as small as xor's trains this way at about two thirds the speed
+	   of plain Python lists.)  Returns the total of the examples'
+	   errors."""
+	self.reserve(1)
+	last = len(self.sizes) - 1
+	forward, backward = [], []
+	for l in range(1, last + 1):
+	    function, derivative = activationFunctions[self.activations[l - 1]]
+	    forward.append((self.values[l - 1][0], self.weights[l - 1],
+			    self.sums[l][0], self.values[l][0, :-1], function))
+	    # The errors of the layer before (if not the inputs) go into
+	    # its deltas.
+	    errors = None
+	    if l > 1:
+		errors = self.deltas[l - 1][0]
+	    backward.insert(0, (self.values[l - 1][0], self.values[l][0, :-1],
+				self.sums[l][0], self.deltas[l][0],
+				self.weights[l - 1][:-1], self.scratch[l - 1],
+				derivative, errors))
+	values, outputs = self.values[0][0, :-1], self.values[last][0, :-1]
+	deltas = self.deltas[last][0]
+	weights, changes, gradient = self.weightBuffer, self.changeBuffer, self.scratchBuffer
+	dot, outer, subtract, multiply = np.dot, np.outer, np.subtract, np.multiply
+	error = 0.0
+	for (x, y) in zip(inputs, desiredResults):
+	    values[:] = x
+	    for (before, layerWeights, sums, after, function) in forward:
+		dot(before, layerWeights, sums)
+		function(sums, after)
+	    subtract(y, outputs, deltas)
+	    error += dot(deltas, deltas)
+	    for (before, after, slopes, delta, nodeWeights, grads,
+		 derivative, errors) in backward:
+		derivative(after, slopes)
+		delta *= slopes
+		outer(before, delta, grads)
+		if errors is not None:
+		    dot(nodeWeights, delta, errors)
+	    # As applyGradient does, for a batch of one.
+	    changes *= momentumFactor
+	    weights += changes
+	    changes[:] = gradient
+	    multiply(gradient, learningRate, gradient)
+	    weights += gradient
+	return 0.5 * error
+
+
+    def dataMatrices(self, data):
+	"""Returns the inputs and the desired outputs of a list of
+	   input-output pairs as two matrices, one row per pair."""
+	inputs = np.array([x for (x,y) in data], float).reshape(len(data), -1)
+	outputs = np.array([y for (x,y) in data], float).reshape(len(data), -1)
+	if inputs.shape[1] != self.sizes[0]:
+	    raise self.sizeMismatch(self.sizes[0], inputs.shape[1])
+	return inputs, outputs
+
+
+    def backPropagateBatch(self,
+			   inputs, desiredResults,
+			   learningRate, momentumFactor):
+	"""Back propagation for a batch of examples at once: inputs and
+	   desiredResults are matrices with a row per example.  The
+	   changes are the average over the batch of those backPropagate
+	   would make, so learningRate means the same for any batch size.
+	   Returns the total of the examples' errors."""
+	error = self.gradient(inputs, desiredResults, self.scratch)
+	self.applyGradient(self.scratchBuffer, len(inputs),
+			   learningRate, momentumFactor)
+	return error
+
+
+    def gradient(self, inputs, desiredResults, gradients):
+	"""Fills in gradients, a list of matrices shaped like the weights,
+	   with the changes to the weights back propagation calls for,
+	   added up over a batch of examples (before the learning rate
+	   or the batch size come into it).  Returns the total of the
+	   examples' errors."""
+
+	# Carry out the forward pass for every example.
+	outputs = self.forward(inputs)
+	size = len(inputs)
+
+	# The output deltas start out as the errors.
+	last = len(self.sizes) - 1
+	deltas = self.deltas[last][:size]
+	np.subtract(desiredResults, outputs, deltas)
+	squareErrors = np.dot(deltas.ravel(), deltas.ravel())
+
+	# Work back through the layers.  Layer l's deltas are the
+	# derivative of its activation times its errors; the errors of
+	# the layer before are the deltas pushed back through the
+	# weights.
+	for l in range(last, 0, -1):
+	    derivative = activationFunctions[self.activations[l - 1]][1]
+	    slopes = self.sums[l][:size]
+	    derivative(self.values[l][:size, :-1], slopes)
+	    deltas *= slopes
+	    np.dot(self.values[l - 1][:size].T, deltas, gradients[l - 1])
+	    if l > 1:
+		errors = self.deltas[l - 1][:size]
+		np.dot(deltas, self.weights[l - 1][:-1].T, errors)
+		deltas = errors
+
+	# Return the (half the sum of squares of the) errors.
+	return 0.5 * float(squareErrors)
+
+
+    def applyGradient(self, gradient, size, learningRate, momentumFactor):
+	"""Updates the weights from a flat buffer holding the gradient
+	   of a batch of size examples (which it overwrites).  The
+	   momentum term uses the previous change, which is then
+	   replaced by this batch's."""
+	self.changeBuffer *= momentumFactor
+	self.weightBuffer += self.changeBuffer
+	np.multiply(gradient, 1.0 / size, self.changeBuffer)
+	np.multiply(self.changeBuffer, learningRate, gradient)
+	self.weightBuffer += gradient
+
+
+    def getWeights(self, layer):
+	"""Returns the weights into the given layer (1 is the first after
+	   the inputs) as a list of lists, a row per node of the layer
+	   before and the bias last."""
+	return self.weights[layer - 1].tolist()
+
+
+    def useTanh(self):
+	"""Changes the activation function of every layer from the sigmoid
+	   function to the hyperbolic tangent."""
+	self.activations = ['tanh'] * len(self.activations)
+
+
+#
+#  Data-parallel training.  The net's weights are moved into shared memory
+#  and worker processes are forked, each with its own copy of the training
+#  data and of the net's layer buffers.  For each batch the parent sends
+#  every worker the indices of its share of the examples; the workers put
+#  their gradients into their own part of a shared buffer, and the parent
+#  adds those up and updates the weights, which the workers then see.
+#  Only the indices and the errors ever go through the pipes.
+#
+class gradientWorkers:
+
+    def __init__(self, net, data, processes=None):
+	"""Starts processes workers (None means one per CPU) computing
+	   gradients for net over the input-output pairs in data."""
+	if processes is None:
+	    processes = multiprocessing.cpu_count()
+	self.net = net
+	self.inputs, self.outputs = net.dataMatrices(data)
+	net.shareWeights()
+	size = len(net.weightBuffer)
+	self.gradients = np.frombuffer(multiprocessing.RawArray('d', processes * size))
+	self.gradients = self.gradients.reshape(processes, size)
+	self.connections, self.workers = [], []
+	for slot in range(processes):
+	    parent, child = multiprocessing.Pipe()
+	    worker = multiprocessing.Process(target=self.serve, args=(child, slot))
+	    worker.daemon = True
+	    worker.start()
+	    child.close()
+	    self.connections.append(parent)
+	    self.workers.append(worker)
+
+
+    def serve(self, connection, slot):
+	"""The loop a worker process runs: for each array of example
+	   indices it receives, it computes their gradient into its slot
+	   and sends back their error, until it receives None."""
+	gradients = self.net.layerViews(self.gradients[slot])
+	while True:
+	    batch = connection.recv()
+	    if batch is None:
+		break
+	    try:
+		connection.send(self.net.gradient(self.inputs[batch],
+						  self.outputs[batch], gradients))
+	    except Exception, e:
+		connection.send(e)
+
+
+    def backPropagate(self, batch, learningRate, momentumFactor):
+	"""Updates the net's weights as backPropagateBatch would for the
+	   examples whose indices are in batch, sharing the gradient out
+	   among the workers.  Returns the total of the examples' errors."""
+	shares = [share for share in np.array_split(batch, len(self.workers))
+		  if len(share)]
+	for (connection, share) in zip(self.connections, shares):
+	    connection.send(share)
+	error = 0.0
+	for connection in self.connections[:len(shares)]:
+	    result = connection.recv()
+	    if isinstance(result, Exception):
+		raise result
+	    error += result
+	gradient = self.gradients[0]
+	for slot in range(1, len(shares)):
+	    gradient += self.gradients[slot]
+	self.net.applyGradient(gradient, len(batch), learningRate, momentumFactor)
+	return error
+
+
+    def close(self):
+	"""Stops the worker processes."""
+	for connection in self.connections:
+	    connection.send(None)
+	    connection.close()
+	for worker in self.workers:
+	    worker.join()
+
+
+#
+#  The neural network with a single hidden layer. It contains three vectors
+#  (the activation values for each of the layers, as of the last evaluate)
+#  and four arrays (two for the weights and two more for the most recent
+#  changes--for momentum), which are those of the underlying multiLayerNet.
+#
+class neuralNet(multiLayerNet):
+
+    def __init__(self, nInput, nHidden, nOutput):
+	multiLayerNet.__init__(self, [nInput, nHidden, nOutput])
+	self.numInput = nInput + 1   # one extra for the bias node
+	self.numHidden = nHidden + 1 # one extra for the bias node
+	self.numOutput = nOutput
+	self.inputLayer = np.ones(self.numInput)
+	self.hiddenLayer = np.ones(self.numHidden)
+	self.outputLayer = np.ones(self.numOutput)
+	self.ihChanges, self.hoChanges = self.changes
+
+
+    def setWeightBuffer(self, buffer):
+	"""Makes the flat buffer hold the weights of both layers."""
+	multiLayerNet.setWeightBuffer(self, buffer)
+	self.ihWeights, self.hoWeights = self.weights
+
+
+    def evaluate(self, inputs):
+	"""Carries out forward propagation on the neural net."""
+	outputs = multiLayerNet.evaluate(self, inputs)
+
+	# Keep the values of the layers.
+	self.inputLayer[:-1] = inputs
+	self.hiddenLayer[:-1] = self.values[1][0, :-1]
+	self.outputLayer[:] = outputs
+
+	# Return a *copy* of the output layer.
+	return outputs
 
 
     def getIHWeights(self):
 	"""Returns the input-hidden weights as a list of lists."""
-	return self.ihWeights
+	return self.ihWeights.tolist()
 
 
     def getHOWeights(self):
 	"""Returns the hidden-output weights as a list of lists."""
-	return self.hoWeights
-
-
-    def useTanh():
-	"""Changes the activation function from the sigmoid function
-           to the hyperbolic tangent."""
-        self.actFunction = tanh
-	self.dactFunction = dtanh
-
+	return self.hoWeights.tolist()
 
 
 
@@ -239,3 +660,83 @@ voterPrefNN.train(voterPreferenceTrainingData)
 print "testing our voter preference neural net: "
 print voterPrefNN.test(voterPreferenceTrainingData)
                                
+
+
+###################################################################
+### checks on the neural net classes, run by testAll()          ###
+
+def testEvaluateBatch():
+    print "Neural net - checking evaluate_batch agrees with evaluate"
+    random.seed(1)
+    net = multiLayerNet([5, 8, 6, 2], ['relu', 'tanh', 'sigmoid'])
+    inputs = [x for (x,y) in voterPreferenceTrainingData]
+    check(np.allclose(net.evaluate_batch(inputs, chunkSize=4),
+		      [net.evaluate(x) for x in inputs]), True)
+    check(net.evaluate_batch([]).shape, (0, 2))
+    check(net.test([]), [])
+    print
+
+def testParallel():
+    print "Neural net - checking workers train as one process does"
+    weights = []
+    for processes in [1, 2]:
+	random.seed(2)
+	net = neuralNet(5, 4, 1)
+	net.train(voterPreferenceTrainingData, iterations=50, printInterval=0,
+		  batchSize=len(voterPreferenceTrainingData), processes=processes)
+	weights.append(net.weightBuffer)
+    check(np.allclose(weights[0], weights[1]), True)
+    print "Neural net - checking workers learn xor"
+    random.seed(3)
+    net = neuralNet(2, 5, 1)
+    net.train(xorTrainingData, learningRate=2.0, printInterval=0, processes=2)
+    check([round(output[0]) for (x, y, output) in net.test(xorTrainingData)],
+	  [y[0] for (x, y) in xorTrainingData])
+    print
+
+def testEarlyStopping():
+    print "Neural net - checking training stops early and keeps the best weights"
+    random.seed(4)
+    data = [([random.random() for i in range(5)], [random.random()])
+	    for k in range(60)]
+    training, validation = data[:40], data[40:]
+    checkpoint = os.path.join(tempfile.mkdtemp(), 'net.npz')
+    net = neuralNet(5, 20, 1)
+    errors = net.train(training, learningRate=2.0, iterations=1000, printInterval=0,
+		       batchSize=10, validation=validation, patience=10,
+		       checkpoint=checkpoint)
+    better(len(errors), 1000)
+    best = net.error(*net.dataMatrices(validation))
+    check(best, min(errors))
+    print "Neural net - checking training resumes from the checkpoint"
+    resumed = neuralNet(5, 20, 1)
+    check(resumed.loadCheckpoint(checkpoint),
+	  (errors.index(best) + 1, best))
+    check(np.array_equal(resumed.weightBuffer, net.weightBuffer), True)
+    more = resumed.train(training, learningRate=2.0, iterations=1000, printInterval=0,
+			 batchSize=10, validation=validation, patience=10,
+			 checkpoint=checkpoint)
+    check(len(more), 10)
+    check(np.array_equal(resumed.weightBuffer, net.weightBuffer), True)
+    print "Neural net - checking a checkpoint is kept without validation"
+    os.remove(checkpoint)
+    net.train(training, iterations=3, printInterval=0, checkpoint=checkpoint)
+    check(resumed.loadCheckpoint(checkpoint), (3, None))
+    check(np.array_equal(resumed.weightBuffer, net.weightBuffer), True)
+    shutil.rmtree(os.path.dirname(checkpoint))
+    print
+
+def testAll():
+    testEvaluateBatch()
+    testParallel()
+    testEarlyStopping()
+
+def better(original, better):
+    if better > original: print "Test passed - improved from " + \
+       str(original) + " to " + str(better)
+    else: print "Test failed - deproved from " + \
+	  str(original) + " to " + str(better)
+
+def check(result, expected):
+    if result == expected: print "Test passed"
+    else: print "Test failed. Expected " + str(expected) + ", got " + str(result)